@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import read_otbm
+from otbm_async import aread_otbm
+from synthetic import generate_map
+
+TICK = 0.005
+
+async def ticker(stalls, stop):
+    # Longest time the event loop went without running this task
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(TICK)
+        now = time.perf_counter()
+        stalls.append(now - last - TICK)
+        last = now
+
+async def load(infile, count, reader):
+    stalls = []
+    stop = asyncio.Event()
+    task = asyncio.create_task(ticker(stalls, stop))
+    start = time.perf_counter()
+    await reader(infile, count)
+    seconds = time.perf_counter() - start
+    stop.set()
+    await task
+    return seconds, max(stalls, default=seconds)
+
+async def read_blocking(infile, count):
+    for _ in range(count):
+        read_otbm(infile)
+        await asyncio.sleep(0)
+
+async def read_async(infile, count):
+    await asyncio.gather(*(aread_otbm(infile) for _ in range(count)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure event loop stalls while loading maps with read_otbm and aread_otbm")
+    parser.add_argument("map", nargs="?", help="OTBM file to load (a synthetic map is generated otherwise)")
+    parser.add_argument("--areas", type=int, default=16, help="tile areas in the synthetic map")
+    parser.add_argument("--count", type=int, default=3, help="maps loaded at once")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        infile = args.map
+        if infile is None:
+            infile = os.path.join(directory, "async.otbm")
+            generate_map(infile, args.areas)
+
+        print(f"{infile}: {os.path.getsize(infile) / 1e6:.1f} MB, {args.count} loads")
+        for name, reader in [("read_otbm", read_blocking), ("aread_otbm", read_async)]:
+            seconds, stall = asyncio.run(load(infile, args.count, reader))
+            print(f"{name:<12} {seconds:8.2f} s {stall * 1000:10.1f} ms longest event loop stall")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import os
+import sys
+import timeit
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import otbm2json
+from otbm2json import HEADERS, NODE_ESC, NODE_INIT, NODE_TERM, escape_characters, read_node, unescape_characters, write_element, write_node
+
+REPEAT = 5
+
+# Per-byte escaping as shipped before the bulk escape layer
+def per_byte_escape_characters(buffer):
+    result = bytearray()
+    for byte in buffer:
+        if byte in [NODE_ESC, NODE_INIT, NODE_TERM]:
+            result.append(NODE_ESC)
+        result.append(byte)
+    return bytes(result)
+
+# Corrected per-byte unescaping: the shipped loop resumed its search at the
+# kept byte (i_esc = index), dropping both bytes of an escaped 0xFD
+def per_byte_unescape_characters(node_data):
+    i_esc = 0
+    while True:
+        index = node_data.find(NODE_ESC, i_esc)
+        if index == -1:
+            break
+        node_data = node_data[:index] + node_data[index + 1:]
+        i_esc = index + 1
+    return node_data
+
+def tile_area():
+    # A fully populated 256x256 tile area whose ground ids all have a high
+    # byte in 0xFD-0xFF, so every tile payload needs escaping.
+    tiles = []
+    for x in range(256):
+        for y in range(256):
+            tiles.append(SimpleNamespace(type=HEADERS["OTBM_TILE"], x=x, y=y, tileid=0xFD00 + (x * y) % 0x300))
+    return SimpleNamespace(type=HEADERS["OTBM_TILE_AREA"], x=1024, y=1024, z=7, tiles=tiles)
+
+def tile_area_payloads():
+    return [write_element(tile) for tile in tile_area().tiles]
+
+def escape_heavy_payloads():
+    # Long text attributes made of control bytes stress the unescape path
+    return [per_byte_escape_characters(bytes([NODE_ESC, NODE_INIT, NODE_TERM]) * 2048) for _ in range(16)]
+
+def bench(label, function, payloads):
+    seconds = min(timeit.repeat(lambda: [function(payload) for payload in payloads], number=1, repeat=REPEAT))
+    size = sum(len(payload) for payload in payloads)
+    print(f"{label:<40} {seconds * 1000:10.2f} ms {size / seconds / 1e6:10.2f} MB/s")
+    return seconds
+
+def main():
+    tiles = tile_area_payloads()
+    raw_tiles = [per_byte_unescape_characters(payload) for payload in tiles]
+    heavy = escape_heavy_payloads()
+    raw_heavy = [per_byte_unescape_characters(payload) for payload in heavy]
+
+    assert [escape_characters(payload) for payload in raw_tiles] == tiles
+    assert [unescape_characters(payload) for payload in tiles] == raw_tiles
+    assert [unescape_characters(payload) for payload in heavy] == raw_heavy
+
+    escaped = sum(payload.count(NODE_ESC) for payload in tiles)
+    print(f"Tile area: {len(tiles)} tiles, {escaped} escape bytes")
+
+    for label, per_byte, bulk, payloads in [
+        ("escape tile area", per_byte_escape_characters, escape_characters, raw_tiles),
+        ("unescape tile area", per_byte_unescape_characters, unescape_characters, tiles),
+        ("escape 6 KB control-byte text", per_byte_escape_characters, escape_characters, raw_heavy),
+        ("unescape 6 KB control-byte text", per_byte_unescape_characters, unescape_characters, heavy),
+    ]:
+        before = bench(f"{label} (per-byte)", per_byte, payloads)
+        after = bench(f"{label} (bulk)", bulk, payloads)
+        print(f"{'speedup':<40} {before / after:10.1f}x")
+
+    area = [write_node(tile_area())]
+    for label, function in [
+        ("serialize tile area", lambda payload: write_node(tile_area_node)),
+        ("parse tile area", lambda payload: read_node(payload)),
+    ]:
+        tile_area_node = tile_area()
+        otbm2json.escape_characters = per_byte_escape_characters
+        otbm2json.unescape_characters = per_byte_unescape_characters
+        before = bench(f"{label} (per-byte)", function, area)
+        otbm2json.escape_characters = escape_characters
+        otbm2json.unescape_characters = unescape_characters
+        after = bench(f"{label} (bulk)", function, area)
+        print(f"{'speedup':<40} {before / after:10.1f}x")
+
+if __name__ == "__main__":
+    main()
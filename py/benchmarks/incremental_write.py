@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import HEADERS, read_otbm, write_otbm
+from otbm_incremental import read_otbm_incremental, write_otbm_incremental
+from synthetic import generate_map
+
+def first_tile(map_data):
+    features = map_data["data"].nodes[0].features
+    return next(feature for feature in features if feature.type == HEADERS["OTBM_TILE_AREA"]).tiles[0]
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure saving a one-tile edit with and without dirty tracking")
+    parser.add_argument("map", nargs="?", help="OTBM file to edit (a synthetic map is generated otherwise)")
+    parser.add_argument("--areas", type=int, default=16, help="tile areas in the synthetic map")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        infile = args.map
+        if infile is None:
+            infile = os.path.join(directory, "incremental.otbm")
+            generate_map(infile, args.areas, attribute_rate=0)
+
+        size = os.path.getsize(infile) / 1e6
+        print(f"{infile}: {size:.1f} MB")
+
+        full = read_otbm(infile)
+        first_tile(full).tileid = 4242
+        seconds = timed(write_otbm, os.path.join(directory, "full.otbm"), full)
+        print(f"{'write_otbm':<24} {seconds:8.2f} s {size / seconds:8.2f} MB/s")
+
+        incremental = read_otbm_incremental(infile)
+        first_tile(incremental).tileid = 4242
+        seconds = timed(write_otbm_incremental, os.path.join(directory, "incremental.otbm"), incremental)
+        print(f"{'write_otbm_incremental':<24} {seconds:8.2f} s {size / seconds:8.2f} MB/s")
+
+        with open(os.path.join(directory, "full.otbm"), "rb") as a, open(os.path.join(directory, "incremental.otbm"), "rb") as b:
+            assert a.read() == b.read()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import CHILD_ATTRIBUTES, Node, node_to_dict, read_otbm, write_otbm
+from otbm_json import json_to_otbm, ndjson_to_otbm, otbm_to_json, otbm_to_ndjson
+
+DEFAULT_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "js", "examples", "chess.otbm")
+
+def legacy_export(infile, outfile):
+    with open(outfile, "w") as f:
+        json.dump(read_otbm(infile), f, default=node_to_dict)
+
+def build_node(fields):
+    children = fields.get(CHILD_ATTRIBUTES.get(fields["type"], "nodes"), [])
+    attributes = {key: value for key, value in fields.items() if key != "type" and not isinstance(value, list)}
+    return Node.create(fields["type"], attributes, [build_node(child) for child in children])
+
+def legacy_import(infile, outfile):
+    with open(infile) as f:
+        document = json.load(f)
+    document["data"] = build_node(document["data"])
+    write_otbm(outfile, document)
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare streaming JSON conversion with json.dump(default=node_to_dict)")
+    parser.add_argument("map", nargs="?", default=DEFAULT_MAP)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = lambda name: os.path.join(directory, name)
+        size = os.path.getsize(args.map) / 1e6
+        print(f"{args.map}: {size:.1f} MB")
+
+        runs = [
+            ("export json.dump", legacy_export, args.map, path("legacy.json")),
+            ("export otbm_to_json", otbm_to_json, args.map, path("map.json")),
+            ("export otbm_to_ndjson", otbm_to_ndjson, args.map, path("map.ndjson")),
+            ("import Node tree", legacy_import, path("legacy.json"), path("legacy.otbm")),
+            ("import json_to_otbm", json_to_otbm, path("map.json"), path("map.otbm")),
+            ("import ndjson_to_otbm", ndjson_to_otbm, path("map.ndjson"), path("ndjson.otbm")),
+        ]
+
+        for label, function, infile, outfile in runs:
+            seconds = timed(function, infile, outfile)
+            print(f"{label:<24} {seconds:8.2f} s {size / seconds:8.2f} MB/s {os.path.getsize(outfile) / 1e6:8.1f} MB out")
+
+        with open(path("legacy.json")) as legacy, open(path("map.json")) as streamed:
+            assert json.load(legacy) == json.load(streamed)
+        with open(path("map.otbm"), "rb") as streamed, open(path("legacy.otbm"), "rb") as legacy, open(path("ndjson.otbm"), "rb") as ndjson:
+            assert streamed.read() == legacy.read() == ndjson.read()
+
+if __name__ == "__main__":
+    main()
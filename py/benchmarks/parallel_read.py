@@ -0,0 +1,55 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import read_otbm, serialize_otbm
+from otbm_parallel import read_columnar_parallel, read_otbm_parallel, serialize_otbm_parallel
+from synthetic import generate_map
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+def measure(infile, workers):
+    size = os.path.getsize(infile) / 1e6
+    print(f"{infile}: {size:.1f} MB, {os.cpu_count()} CPUs")
+
+    serial = timed(read_otbm, infile)
+    print(f"{'read_otbm':<36} {serial:8.2f} s {size / serial:8.2f} MB/s")
+
+    for label, function in [("read_otbm_parallel", read_otbm_parallel), ("read_columnar_parallel", read_columnar_parallel)]:
+        for count in workers:
+            seconds = timed(function, infile, workers=count, min_size=0)
+            print(f"{label + f' x{count}':<36} {seconds:8.2f} s {size / seconds:8.2f} MB/s {serial / seconds:6.2f}x")
+
+    data = read_otbm(infile)
+    serial = timed(serialize_otbm, data)
+    print(f"{'serialize_otbm':<36} {serial:8.2f} s {size / serial:8.2f} MB/s")
+    for executor in ["process", "thread"]:
+        for count in workers:
+            seconds = timed(serialize_otbm_parallel, data, workers=count, executor=executor)
+            label = f"serialize_otbm_parallel {executor} x{count}"
+            print(f"{label:<36} {seconds:8.2f} s {size / seconds:8.2f} MB/s {serial / seconds:6.2f}x")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure parallel tile area decoding and serialization")
+    parser.add_argument("map", nargs="?", help="OTBM file to read (a synthetic map is generated otherwise)")
+    parser.add_argument("--areas", type=int, default=16, help="tile areas in the synthetic map")
+    parser.add_argument("--workers", type=int, nargs="+", default=None)
+    args = parser.parse_args()
+
+    workers = args.workers or sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    with tempfile.TemporaryDirectory() as directory:
+        infile = args.map
+        if infile is None:
+            infile = os.path.join(directory, "parallel.otbm")
+            generate_map(infile, args.areas, attribute_rate=0)
+        measure(infile, workers)
+
+if __name__ == "__main__":
+    main()
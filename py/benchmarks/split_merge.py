@@ -0,0 +1,43 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import read_otbm, write_otbm
+from otbm_regions import merge_otbm, split_otbm
+from synthetic import generate_map
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure splitting a map into regions and merging them back against a full read/write")
+    parser.add_argument("map", nargs="?", help="OTBM file to split (a synthetic map is generated otherwise)")
+    parser.add_argument("--areas", type=int, default=16, help="tile areas in the synthetic map")
+    parser.add_argument("--columns", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        infile = args.map
+        if infile is None:
+            infile = os.path.join(directory, "world.otbm")
+            generate_map(infile, args.areas)
+
+        size = os.path.getsize(infile) / 1e6
+        print(f"{infile}: {size:.1f} MB, {args.columns}x{args.rows} regions")
+
+        seconds, paths = timed(split_otbm, infile, os.path.join(directory, "regions"), args.columns, args.rows)
+        print(f"{'split_otbm':<12} {seconds:8.2f} s {size / seconds:8.2f} MB/s")
+        seconds, _ = timed(merge_otbm, paths, os.path.join(directory, "merged.otbm"))
+        print(f"{'merge_otbm':<12} {seconds:8.2f} s {size / seconds:8.2f} MB/s")
+        seconds, _ = timed(lambda: write_otbm(os.path.join(directory, "full.otbm"), read_otbm(infile)))
+        print(f"{'read+write':<12} {seconds:8.2f} s {size / seconds:8.2f} MB/s")
+
+if __name__ == "__main__":
+    main()
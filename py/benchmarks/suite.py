@@ -0,0 +1,155 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import __VERSION__, iter_otbm, node_to_dict, read_otbm, write_otbm
+from otbm_json import otbm_to_json
+from synthetic import ATTRIBUTE_KINDS, generate_map
+
+def read(infile, outfile):
+    read_otbm(infile)
+
+def write(infile, outfile):
+    data = read_otbm(infile)
+    start = time.perf_counter()
+    write_otbm(outfile, data)
+    return time.perf_counter() - start
+
+def round_trip(infile, outfile):
+    write_otbm(outfile, read_otbm(infile))
+
+def json_export(infile, outfile):
+    with open(outfile, "w") as f:
+        json.dump(read_otbm(infile), f, default=node_to_dict)
+
+def json_stream(infile, outfile):
+    otbm_to_json(infile, outfile)
+
+OPERATIONS = {
+    "read": read,
+    "write": write,
+    "round_trip": round_trip,
+    "json_export": json_export,
+    "json_stream": json_stream,
+}
+
+def peak_rss():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def measure(operation, infile):
+    # Runs in a fresh interpreter so the peak RSS belongs to one operation.
+    # Operations that need untimed setup return their own timing.
+    with tempfile.TemporaryDirectory() as directory:
+        outfile = os.path.join(directory, "out")
+        baseline = peak_rss()
+        start = time.perf_counter()
+        seconds = OPERATIONS[operation](infile, outfile)
+        seconds = seconds if seconds is not None else time.perf_counter() - start
+        return {"seconds": seconds, "peak_rss": peak_rss(), "baseline_rss": baseline}
+
+def run(operation, infile, repeat):
+    samples = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--measure", operation, infile],
+            check=True, capture_output=True, text=True
+        ).stdout
+        samples.append(json.loads(output))
+    return {
+        "seconds": min(sample["seconds"] for sample in samples),
+        "peak_rss": max(sample["peak_rss"] for sample in samples),
+        "baseline_rss": min(sample["baseline_rss"] for sample in samples),
+    }
+
+def count_map(infile):
+    stats = {"tiles": 0, "items": 0}
+    for event, node, parent in iter_otbm(infile):
+        if event == "tile":
+            stats["tiles"] += 1
+            stack = list(getattr(node, "items", []))
+            while stack:
+                item = stack.pop()
+                stats["items"] += 1
+                stack.extend(getattr(item, "content", []))
+    return stats
+
+def benchmark(args, infile, parameters, stats):
+    size = os.path.getsize(infile)
+    print(f"{infile}: {size / 1e6:.1f} MB, {stats['tiles']} tiles, {stats['items']} items")
+
+    results = {}
+    for operation in args.operations:
+        result = run(operation, infile, args.repeat)
+        result["mb_per_s"] = size / 1e6 / result["seconds"]
+        result["tiles_per_s"] = stats["tiles"] / result["seconds"]
+        results[operation] = result
+        print(
+            f"{operation:<12} {result['seconds']:8.2f} s {result['mb_per_s']:8.2f} MB/s "
+            f"{result['tiles_per_s']:12.0f} tiles/s {result['peak_rss'] / 1e6:8.1f} MB peak RSS"
+        )
+
+    report = {
+        "version": __VERSION__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "map": {"path": args.map, "size": size, **stats, "parameters": parameters},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure reader/writer throughput and memory on a synthetic or given map")
+    parser.add_argument("map", nargs="?", help="OTBM file to measure (a synthetic map is generated otherwise)")
+    parser.add_argument("--areas", type=int, default=4, help="256x256 tile areas per floor")
+    parser.add_argument("--floors", type=int, default=1)
+    parser.add_argument("--tile-density", type=float, default=1.0, help="fraction of positions with a tile")
+    parser.add_argument("--item-density", type=float, default=0.5, help="mean items per tile")
+    parser.add_argument("--attribute-rate", type=float, default=0.05, help="probability of an attribute per tile/item")
+    parser.add_argument("--attributes", nargs="+", default=ATTRIBUTE_KINDS, choices=ATTRIBUTE_KINDS)
+    parser.add_argument("--escape-rate", type=float, default=0.01, help="probability of a control byte per id field")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--operations", nargs="+", default=list(OPERATIONS), choices=list(OPERATIONS))
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", default=f"results-{__VERSION__}.json", help="JSON file the results are saved to")
+    parser.add_argument("--measure", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure(args.measure, args.map)))
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        parameters = None
+        infile = args.map
+        if infile is None:
+            parameters = {
+                "areas": args.areas,
+                "floors": args.floors,
+                "tile_density": args.tile_density,
+                "item_density": args.item_density,
+                "attribute_rate": args.attribute_rate,
+                "attributes": args.attributes,
+                "escape_rate": args.escape_rate,
+                "seed": args.seed,
+            }
+            infile = os.path.join(directory, "synthetic.otbm")
+            stats = generate_map(infile, **parameters)
+        else:
+            stats = count_map(infile)
+        benchmark(args, infile, parameters, stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import random
+import string
+
+from otbm2json import HEADERS, Node, OTBMWriter
+
+ATTRIBUTE_KINDS = ["count", "actions", "text", "teleport", "container", "zones", "house"]
+ESCAPE_BYTES = [0xFD, 0xFE, 0xFF]
+GROUND_IDS = [100, 101, 406, 407]
+
+def maybe_escaped(rng, value, escape_rate):
+    # Forces a control byte into the low byte of a u16/u32 field
+    if escape_rate and rng.random() < escape_rate:
+        return value & ~0xFF | rng.choice(ESCAPE_BYTES)
+    return value
+
+def random_text(rng, words=6):
+    return " ".join("".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 8))) for _ in range(words))
+
+def random_count(rng, density):
+    whole = int(density)
+    return whole + (rng.random() < density - whole)
+
+def random_item(rng, attribute_rate, attributes, escape_rate, depth=0):
+    fields = {"id": maybe_escaped(rng, rng.randrange(1000, 3000), escape_rate)}
+    children = None
+    kinds = [kind for kind in attributes if kind in {"count", "actions", "text", "teleport", "container"}]
+
+    if kinds and rng.random() < attribute_rate:
+        kind = rng.choice(kinds)
+        if kind == "count":
+            fields["count"] = rng.randint(1, 100)
+        elif kind == "actions":
+            fields["aid"] = maybe_escaped(rng, rng.randrange(1000, 65535), escape_rate)
+            fields["uid"] = maybe_escaped(rng, rng.randrange(1000, 65535), escape_rate)
+        elif kind == "text":
+            fields["text"] = random_text(rng)
+        elif kind == "teleport":
+            fields["destination"] = {"x": rng.randrange(0, 2048), "y": rng.randrange(0, 2048), "z": rng.randrange(0, 16)}
+        elif depth < 2:
+            children = [random_item(rng, attribute_rate, attributes, escape_rate, depth + 1) for _ in range(rng.randint(1, 4))]
+
+    return Node.create(HEADERS["OTBM_ITEM"], fields, children)
+
+def generate_map(outfile, areas=16, floors=1, tile_density=1.0, item_density=0.2, attribute_rate=0.05, attributes=ATTRIBUTE_KINDS, escape_rate=0.0, seed=0):
+    # Square grid of 256x256 tile areas per floor. Returns tile and item
+    # counts, which the harness needs for its per-tile rates.
+    rng = random.Random(seed)
+    side = max(1, int(areas ** 0.5))
+    header = {"version": 2, "mapWidth": side * 256, "mapHeight": side * 256, "itemsMajorVersion": 3, "itemsMinorVersion": 57}
+    stats = {"areas": 0, "tiles": 0, "items": 0}
+
+    with OTBMWriter(outfile, header, {"description": "synthetic benchmark map"}) as writer:
+        for z in range(7, 7 - floors, -1):
+            for area in range(areas):
+                writer.begin_area(area % side * 256, area // side * 256, z)
+                stats["areas"] += 1
+                for x in range(256):
+                    for y in range(256):
+                        if tile_density < 1 and rng.random() >= tile_density:
+                            continue
+                        writer.add_tile(random_tile(rng, x, y, item_density, attribute_rate, attributes, escape_rate, stats))
+                writer.end_area()
+
+        if "house" in attributes or "teleport" in attributes:
+            writer.begin_towns()
+            writer.add_town(Node.create(HEADERS["OTBM_TOWN"], {"townid": 1, "name": "Synthetic", "x": 128, "y": 128, "z": 7}))
+            writer.end_towns()
+
+    return stats
+
+def random_tile(rng, x, y, item_density, attribute_rate, attributes, escape_rate, stats):
+    tile_type = HEADERS["OTBM_TILE"]
+    fields = {"x": x, "y": y, "tileid": maybe_escaped(rng, rng.choice(GROUND_IDS), escape_rate)}
+
+    if "house" in attributes and rng.random() < attribute_rate:
+        tile_type = HEADERS["OTBM_HOUSETILE"]
+        fields["houseId"] = maybe_escaped(rng, rng.randrange(1, 5000), escape_rate)
+    if "zones" in attributes and rng.random() < attribute_rate:
+        fields["zones"] = {"protection": True, "noPVP": False, "noLogout": rng.random() < 0.5, "PVPZone": False, "refresh": False}
+
+    items = [random_item(rng, attribute_rate, attributes, escape_rate) for _ in range(random_count(rng, item_density))]
+    stats["tiles"] += 1
+    stats["items"] += count_items(items)
+    return Node.create(tile_type, fields, items)
+
+def count_items(items):
+    return sum(1 + count_items(getattr(item, "content", [])) for item in items)
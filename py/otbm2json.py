@@ -1,3 +1,9 @@
+import contextlib
+import itertools
+import mmap
+import os
+import re
+import shutil
 import struct
 import json
 from datetime import datetime
@@ -40,437 +46,771 @@ HEADERS = {
 NODE_ESC = 0xFD
 NODE_INIT = 0xFE
 NODE_TERM = 0xFF
+NODE_CONTROL = re.compile(b"[\xfd\xfe\xff]")
+NODE_ESCAPED = re.compile(b"\xfd(.)", re.DOTALL)
+NODE_ESCAPED_OTHER = re.compile(b"\xfd[^\xfd\xfe\xff]")
+STREAM_CHUNK_SIZE = 1 << 20
+BULK_UNESCAPE_SIZE = 64
 __VERSION__ = "1.0.1"
+TEMPORARY_IDS = itertools.count()
+
+NODE_EVENTS = {
+    HEADERS["OTBM_MAP_HEADER"]: "header",
+    HEADERS["OTBM_MAP_DATA"]: "map_data",
+    HEADERS["OTBM_TILE_AREA"]: "tile_area",
+    HEADERS["OTBM_TOWNS"]: "towns",
+    HEADERS["OTBM_WAYPOINTS"]: "waypoints",
+    HEADERS["OTBM_TILE"]: "tile",
+    HEADERS["OTBM_HOUSETILE"]: "tile",
+    HEADERS["OTBM_TOWN"]: "town",
+    HEADERS["OTBM_WAYPOINT"]: "waypoint",
+}
+
+CHILD_ATTRIBUTES = {
+    HEADERS["OTBM_TILE_AREA"]: "tiles",
+    HEADERS["OTBM_TILE"]: "items",
+    HEADERS["OTBM_HOUSETILE"]: "items",
+    HEADERS["OTBM_TOWNS"]: "towns",
+    HEADERS["OTBM_ITEM"]: "content",
+    HEADERS["OTBM_MAP_DATA"]: "features",
+}
+
+CHILD_FIELDS = {"nodes", "features", "tiles", "items", "towns", "content"}
+
+POSITION_LIMITS = {
+    HEADERS["OTBM_TILE_AREA"]: (65535, 255),
+    HEADERS["OTBM_TILE"]: (255, None),
+    HEADERS["OTBM_HOUSETILE"]: (255, None),
+    HEADERS["OTBM_TOWN"]: (65535, 255),
+    HEADERS["OTBM_WAYPOINT"]: (65535, 255),
+}
+
+CONTAINER_NODES = {
+    HEADERS["OTBM_MAP_HEADER"],
+    HEADERS["OTBM_MAP_DATA"],
+    HEADERS["OTBM_TILE_AREA"],
+    HEADERS["OTBM_TOWNS"],
+    HEADERS["OTBM_WAYPOINTS"],
+}
 
 def write_otbm(outfile, data):
-    with open(outfile, "wb") as f:
-        f.write(serialize_otbm(data))
+    with open(outfile, "wb", buffering=STREAM_CHUNK_SIZE) as f:
+        f.write(struct.pack("<I", 0x00000000))
+        f.writelines(iter_node_chunks(data["data"]))
+
+@contextlib.contextmanager
+def replacing_file(outfile):
+    # Yields a temporary path next to outfile to write the new file to. Once
+    # the block completes it replaces outfile, keeping outfile's permissions;
+    # a failed block removes it and leaves outfile untouched.
+    temporary = f"{outfile}.{os.getpid()}.{next(TEMPORARY_IDS)}.tmp"
+    try:
+        yield temporary
+        if os.path.exists(outfile):
+            shutil.copymode(outfile, temporary)
+        os.replace(temporary, outfile)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
 
 def node_to_dict(node):
+    if isinstance(node, Node):
+        return dict(sorted(node.fields().items()))
     return {key: getattr(node, key) for key in dir(node) if not key.startswith('_') and not callable(getattr(node, key))}
 
-def serialize_otbm(data):
-    def write_node(node):
-        return b"".join([
-            struct.pack("B", NODE_INIT),
-            write_element(node),
-            b"".join(map(write_node, get_child_node(node))),
-            struct.pack("B", NODE_TERM),
-        ])
-
-    def get_child_node(node):
-        return get_child_node_real(node) or []
-
-    def get_child_node_real(node):
-        return {
-            HEADERS["OTBM_TILE_AREA"]: getattr(node, "tiles", []),
-            HEADERS["OTBM_TILE"]: getattr(node, "items", []),
-            HEADERS["OTBM_HOUSETILE"]: getattr(node, "items", []),
-            HEADERS["OTBM_TOWNS"]: getattr(node, "towns", []),
-            HEADERS["OTBM_ITEM"]: getattr(node, "content", []),
-            HEADERS["OTBM_MAP_DATA"]: getattr(node, "features", []),
-        }.get(node.type, getattr(node, "nodes", []))
-
-    def validate_node(node):
-        if hasattr(node, "x") and (node.x < 0 or node.x > 255):
-            raise ValueError(f"Invalid node range: {json.dumps(node_to_dict(node))}")
-        if hasattr(node, "y") and (node.y < 0 or node.y > 255):
-            raise ValueError(f"Invalid node range: {json.dumps(node_to_dict(node))}")
-        if hasattr(node, "z") and (node.z < 0 or node.z > 255):
-            raise ValueError(f"Invalid node range: {json.dumps(node_to_dict(node))}")
-
-    def write_element(node):
-        validate_node(node)
-        buffer = b""
-        type = node.type
-
-        if type == HEADERS["OTBM_MAP_HEADER"]:
-            buffer = struct.pack(
-                "<BIIIIHH",
-                HEADERS["OTBM_MAP_HEADER"],
-                node.version,
-                node.mapWidth,
-                node.mapHeight,
-                node.itemsMajorVersion,
-                node.itemsMinorVersion,
-                0
-            )
-        elif type == HEADERS["OTBM_MAP_DATA"]:
-            buffer = struct.pack("<B", HEADERS["OTBM_MAP_DATA"])
-            buffer += write_attributes(node)
-        elif type == HEADERS["OTBM_TILE_AREA"]:
-            buffer = struct.pack(
-                "<BHHB",
-                HEADERS["OTBM_TILE_AREA"],
-                node.x,
-                node.y,
-                node.z
-            )
-        elif type == HEADERS["OTBM_TILE"]:
-            buffer = struct.pack(
-                "<BBB",
-                HEADERS["OTBM_TILE"],
-                node.x,
-                node.y
-            )
-            buffer += write_attributes(node)
-        elif type == HEADERS["OTBM_HOUSETILE"]:
-            buffer = struct.pack(
-                "<BBBI",
-                HEADERS["OTBM_HOUSETILE"],
-                node.x,
-                node.y,
-                node.houseId
-            )
-            buffer += write_attributes(node)
-        elif type == HEADERS["OTBM_ITEM"]:
-            buffer = struct.pack("<BH", HEADERS["OTBM_ITEM"], node.id)
-            buffer += write_attributes(node)
-        elif type == HEADERS["OTBM_WAYPOINT"]:
-            name_len = len(node.name)
-            buffer = struct.pack(
-                f"<BH{name_len}sHHB",
-                HEADERS["OTBM_WAYPOINT"],
-                name_len,
-                node.name.encode("ascii"),
-                node.x,
-                node.y,
-                node.z
-            )
-        elif type == HEADERS["OTBM_WAYPOINTS"]:
-            buffer = struct.pack("<B", HEADERS["OTBM_WAYPOINTS"])
-        elif type == HEADERS["OTBM_TOWNS"]:
-            buffer = struct.pack("<B", HEADERS["OTBM_TOWNS"])
-        elif type == HEADERS["OTBM_TOWN"]:
-            name_len = len(node.name)
-            buffer = struct.pack(
-                f"<BIBH{name_len}sHHB",
-                HEADERS["OTBM_TOWN"],
-                node.townid,
-                name_len,
-                node.name.encode("ascii"),
-                node.x,
-                node.y,
-                node.z
-            )
-        else:
-            raise ValueError(f"Could not write node. Unknown node type: {node.type}")
-
-        return escape_characters(buffer)
-
-    def escape_characters(buffer):
-        result = bytearray()
-        for byte in buffer:
-            if byte in [NODE_ESC, NODE_INIT, NODE_TERM]:
-                result.append(NODE_ESC)
-            result.append(byte)
-        return bytes(result)
-
-    def write_attributes(node):
-        attribute_buffer = bytearray()
-
-        def write_ascii_string_16le(string):
-            length = len(string)
-            return struct.pack(f"<H{length}s", length, string.encode("ascii"))
-
-        if hasattr(node, "destination"):
-            attribute_buffer.extend(struct.pack("<BHHB", HEADERS["OTBM_ATTR_TELE_DEST"], node.destination["x"], node.destination["y"], node.destination["z"]))
-        if hasattr(node, "description"):
-            attribute_buffer.extend(struct.pack("<B", HEADERS["OTBM_ATTR_DESCRIPTION"]) + write_ascii_string_16le(node.description))
-        if hasattr(node, "uid"):
-            attribute_buffer.extend(struct.pack("<BH", HEADERS["OTBM_ATTR_UNIQUE_ID"], node.uid))
-        if hasattr(node, "aid"):
-            attribute_buffer.extend(struct.pack("<BH", HEADERS["OTBM_ATTR_ACTION_ID"], node.aid))
-        if hasattr(node, "runeCharges"):
-            attribute_buffer.extend(struct.pack("<BH", HEADERS["OTBM_ATTR_RUNE_CHARGES"], node.runeCharges))
-        if hasattr(node, "spawnfile"):
-            attribute_buffer.extend(struct.pack("<B", HEADERS["OTBM_ATTR_EXT_SPAWN_FILE"]) + write_ascii_string_16le(node.spawnfile))
-        if hasattr(node, "text"):
-            attribute_buffer.extend(struct.pack("<B", HEADERS["OTBM_ATTR_TEXT"]) + write_ascii_string_16le(node.text))
-        if hasattr(node, "housefile"):
-            attribute_buffer.extend(struct.pack("<B", HEADERS["OTBM_ATTR_EXT_HOUSE_FILE"]) + write_ascii_string_16le(node.housefile))
-        if hasattr(node, "tileid"):
-            attribute_buffer.extend(struct.pack("<BH", HEADERS["OTBM_ATTR_ITEM"], node.tileid))
-        if hasattr(node, "count"):
-            attribute_buffer.extend(struct.pack("<BB", HEADERS["OTBM_ATTR_COUNT"], node.count))
-        if hasattr(node, "depotId"):
-            attribute_buffer.extend(struct.pack("<BH", HEADERS["OTBM_ATTR_DEPOT_ID"], node.depotId))
-        if hasattr(node, "houseDoorId"):
-            attribute_buffer.extend(struct.pack("<BB", HEADERS["OTBM_ATTR_HOUSEDOORID"], node.houseDoorId))
-        if hasattr(node, "zones"):
-            attribute_buffer.extend(struct.pack("<BI", HEADERS["OTBM_ATTR_TILE_FLAGS"], write_flags(node.zones)))
-
-        return bytes(attribute_buffer)
-
-    def write_flags(zones):
-        flags = HEADERS["TILESTATE_NONE"]
-        flags |= zones.get("protection", 0) * HEADERS["TILESTATE_PROTECTIONZONE"]
-        flags |= zones.get("noPVP", 0) * HEADERS["TILESTATE_NOPVP"]
-        flags |= zones.get("noLogout", 0) * HEADERS["TILESTATE_NOLOGOUT"]
-        flags |= zones.get("PVPZone", 0) * HEADERS["TILESTATE_PVPZONE"]
-        flags |= zones.get("refresh", 0) * HEADERS["TILESTATE_REFRESH"]
-        return flags
+def node_fields(node):
+    if isinstance(node, Node):
+        return node.fields()
+    return vars(node) if hasattr(node, "__dict__") else node_to_dict(node)
+
+def node_attributes(node):
+    return {key: value for key, value in node_fields(node).items() if key != "type" and key not in CHILD_FIELDS}
 
+def serialize_otbm(data):
     version = struct.pack("<I", 0x00000000)
     result = version + write_node(data["data"])
     return result
 
+def write_node(node):
+    return b"".join([
+        struct.pack("B", NODE_INIT),
+        write_element(node),
+        b"".join(map(write_node, get_child_node(node))),
+        struct.pack("B", NODE_TERM),
+    ])
+
+def iter_node_chunks(node):
+    children = get_child_node(node)
+    if node.type in CONTAINER_NODES:
+        yield struct.pack("B", NODE_INIT) + write_element(node)
+        for child in children:
+            yield from iter_node_chunks(child)
+        yield struct.pack("B", NODE_TERM)
+    else:
+        yield write_node(node)
+
+def get_child_node(node):
+    return get_child_node_real(node) or []
+
+def get_child_node_real(node):
+    return getattr(node, CHILD_ATTRIBUTES.get(node.type, "nodes"), [])
+
+def validate_node(node):
+    # Per-type (x/y limit, z limit); tiles are positioned relative to their area
+    limits = POSITION_LIMITS.get(node.type)
+    if limits is None:
+        return
+    limit, z_limit = limits
+    if not 0 <= node.x <= limit or not 0 <= node.y <= limit or z_limit and not 0 <= node.z <= z_limit:
+        raise ValueError(f"Invalid node range: {json.dumps(node_to_dict(node), default=node_to_dict)}")
+
+def write_element(node):
+    validate_node(node)
+    writer = NODE_WRITERS.get(node.type)
+    if writer is None:
+        raise ValueError(f"Could not write node. Unknown node type: {node.type}")
+
+    return escape_characters(writer(node))
+
+def escape_characters(buffer):
+    if NODE_CONTROL.search(buffer) is None:
+        return bytes(buffer)
+    return bytes(buffer).replace(b"\xfd", b"\xfd\xfd").replace(b"\xfe", b"\xfd\xfe").replace(b"\xff", b"\xfd\xff")
+
+def unescape_characters(data):
+    index = data.find(NODE_ESC)
+    if index == -1:
+        return data
+    if len(data) < BULK_UNESCAPE_SIZE:
+        # Call overhead dominates at tile/item payload sizes: a replace chain
+        # with an exact check for non-control escapes measured no faster
+        while index != -1:
+            data = data[:index] + data[index + 1:]
+            index = data.find(NODE_ESC, index + 1)
+        return data
+    if NODE_ESCAPED_OTHER.search(data) is not None:
+        return NODE_ESCAPED.sub(b"\\1", data)
+    return data.replace(b"\xfd\xfe", b"\xfe").replace(b"\xfd\xff", b"\xff").replace(b"\xfd\xfd", b"\xfd")
+
+def write_attributes(node):
+    writers = ATTRIBUTE_WRITERS
+    fields = node.attributes() if isinstance(node, Node) else node_fields(node)
+    present = [writers[name] for name in fields if name in writers]
+    if len(present) > 1:
+        present.sort(key=lambda writer: writer[0])
+
+    buffer = b"".join([codec.write(fields[codec.name]) for _, codec in present])
+    unknown = fields.get(UNKNOWN_ATTRIBUTES)
+    if unknown:
+        buffer += bytes.fromhex(unknown)
+    return buffer
+
+def write_flags(zones):
+    flags = HEADERS["TILESTATE_NONE"]
+    flags |= zones.get("protection", 0) * HEADERS["TILESTATE_PROTECTIONZONE"]
+    flags |= zones.get("noPVP", 0) * HEADERS["TILESTATE_NOPVP"]
+    flags |= zones.get("noLogout", 0) * HEADERS["TILESTATE_NOLOGOUT"]
+    flags |= zones.get("PVPZone", 0) * HEADERS["TILESTATE_PVPZONE"]
+    flags |= zones.get("refresh", 0) * HEADERS["TILESTATE_REFRESH"]
+    return flags
+
 class Node:
+    # Each node type has its own slotted class holding the fields most nodes
+    # of that type carry; rare attributes (item text, teleport destinations,
+    # unknown attribute bytes, ...) go to the "extra" dict, created on first use.
+    __slots__ = ("type", "extra")
+    FIELDS = ("type",)
+    ATTRIBUTES = ()
+
+    def __new__(cls, data=None, children=None):
+        if cls is Node and data:
+            cls = NODE_CLASSES.get(data[0], Node)
+        return object.__new__(cls)
+
     def __init__(self, data, children):
         data = self.remove_escape_characters(data)
         node_type = data[0]
-
-        if node_type == HEADERS["OTBM_MAP_HEADER"]:
-            self.type = HEADERS["OTBM_MAP_HEADER"]
-            self.version, self.mapWidth, self.mapHeight, self.itemsMajorVersion, self.itemsMinorVersion = struct.unpack("<IHHII", data[1:])
-        elif node_type == HEADERS["OTBM_MAP_DATA"]:
-            self.type = HEADERS["OTBM_MAP_DATA"]
-            self.__dict__.update(read_attributes(data[1:]))
-        elif node_type == HEADERS["OTBM_TILE_AREA"]:
-            self.type = HEADERS["OTBM_TILE_AREA"]
-            self.x, self.y, self.z = struct.unpack("<HHB", data[1:6])
-        elif node_type == HEADERS["OTBM_TILE"]:
-            self.type = HEADERS["OTBM_TILE"]
-            self.x, self.y = struct.unpack("<BB", data[1:3])
-            self.__dict__.update(read_attributes(data[3:]))
-        elif node_type == HEADERS["OTBM_ITEM"]:
-            self.type = HEADERS["OTBM_ITEM"]
-            self.id, = struct.unpack("<H", data[1:3])
-            self.__dict__.update(read_attributes(data[3:]))
-        elif node_type == HEADERS["OTBM_HOUSETILE"]:
-            self.type = HEADERS["OTBM_HOUSETILE"]
-            self.x, self.y, self.houseId = struct.unpack("<BBI", data[1:7])
-            self.__dict__.update(read_attributes(data[7:]))
-        elif node_type == HEADERS["OTBM_WAYPOINTS"]:
-            self.type = HEADERS["OTBM_WAYPOINTS"]
-        elif node_type == HEADERS["OTBM_WAYPOINT"]:
-            self.type = HEADERS["OTBM_WAYPOINT"]
-            name_len = struct.unpack("<H", data[1:3])[0]
-            self.name = data[3:3 + name_len].decode("ascii")
-            self.x, self.y, self.z = struct.unpack("<HHB", data[3 + name_len:])
-        elif node_type == HEADERS["OTBM_TOWNS"]:
-            self.type = HEADERS["OTBM_TOWNS"]
-        elif node_type == HEADERS["OTBM_TOWN"]:
-            self.type = HEADERS["OTBM_TOWN"]
-            self.townid = struct.unpack("<I", data[1:5])[0]
-            name_len = struct.unpack("<H", data[5:7])[0]
-            self.name = data[7:7 + name_len].decode("ascii")
-            self.x, self.y, self.z = struct.unpack("<HHB", data[7 + name_len:])
-        else:
+        reader = NODE_READERS.get(node_type)
+        if reader is None:
             raise ValueError(f"Unknown node type: {node_type}")
 
+        self.type = node_type
+        self.extra = None
+        reader(self, data)
         self.set_children(children)
 
+    @classmethod
+    def create(cls, node_type, attributes, children=None):
+        if cls is Node:
+            cls = NODE_CLASSES.get(node_type, Node)
+        node = object.__new__(cls)
+        node.type = node_type
+        node.extra = None
+        set_attributes(node, attributes)
+        node.set_children(children)
+        return node
+
     def remove_escape_characters(self, node_data):
-        i_esc = 0
-        while True:
-            index = node_data.find(NODE_ESC, i_esc)
-            if index == -1:
-                break
-            node_data = node_data[:index] + node_data[index + 1:]
-            i_esc = index
-        return node_data
+        return unescape_characters(node_data)
 
     def set_children(self, children):
         if not children:
             return
 
-        if self.type == HEADERS["OTBM_TILE_AREA"]:
-            self.tiles = children
-        elif self.type in [HEADERS["OTBM_TILE"], HEADERS["OTBM_HOUSETILE"]]:
-            self.items = children
-        elif self.type == HEADERS["OTBM_TOWNS"]:
-            self.towns = children
-        elif self.type == HEADERS["OTBM_ITEM"]:
-            self.content = children
-        elif self.type == HEADERS["OTBM_MAP_DATA"]:
-            self.features = children
-        else:
-            self.nodes = children
+        setattr(self, CHILD_ATTRIBUTES.get(self.type, "nodes"), children)
+
+    def fields(self):
+        fields = {}
+        for name in self.FIELDS:
+            value = getattr(self, name, fields)
+            if value is not fields:
+                fields[name] = value
+        if self.extra:
+            fields.update(self.extra)
+        return fields
+
+    def attributes(self):
+        # Fields write_attributes may encode: attribute slots and extra
+        attributes = {}
+        for name in self.ATTRIBUTES:
+            value = getattr(self, name, attributes)
+            if value is not attributes:
+                attributes[name] = value
+        if self.extra:
+            attributes.update(self.extra)
+        return attributes
+
+class MapHeader(Node):
+    __slots__ = ("version", "mapWidth", "mapHeight", "itemsMajorVersion", "itemsMinorVersion", "nodes")
+    FIELDS = Node.FIELDS + __slots__
+
+class MapData(Node):
+    __slots__ = ("description", "spawnfile", "housefile", "features")
+    FIELDS = Node.FIELDS + __slots__
+    ATTRIBUTES = ("description", "spawnfile", "housefile")
+
+class TileArea(Node):
+    __slots__ = ("x", "y", "z", "tiles")
+    FIELDS = Node.FIELDS + __slots__
+
+class Tile(Node):
+    __slots__ = ("x", "y", "tileid", "items")
+    FIELDS = Node.FIELDS + __slots__
+    ATTRIBUTES = ("tileid",)
+
+class HouseTile(Tile):
+    __slots__ = ("houseId",)
+    FIELDS = Tile.FIELDS + __slots__
+
+class Item(Node):
+    __slots__ = ("id", "count", "content")
+    FIELDS = Node.FIELDS + __slots__
+    ATTRIBUTES = ("count",)
+
+class Towns(Node):
+    __slots__ = ("towns",)
+    FIELDS = Node.FIELDS + __slots__
+
+class Town(Node):
+    __slots__ = ("townid", "name", "x", "y", "z")
+    FIELDS = Node.FIELDS + __slots__
+
+class Waypoints(Node):
+    __slots__ = ("nodes",)
+    FIELDS = Node.FIELDS + __slots__
+
+class Waypoint(Node):
+    __slots__ = ("name", "x", "y", "z")
+    FIELDS = Node.FIELDS + __slots__
+
+NODE_CLASSES = {
+    HEADERS["OTBM_MAP_HEADER"]: MapHeader,
+    HEADERS["OTBM_MAP_DATA"]: MapData,
+    HEADERS["OTBM_TILE_AREA"]: TileArea,
+    HEADERS["OTBM_TILE"]: Tile,
+    HEADERS["OTBM_HOUSETILE"]: HouseTile,
+    HEADERS["OTBM_ITEM"]: Item,
+    HEADERS["OTBM_TOWNS"]: Towns,
+    HEADERS["OTBM_TOWN"]: Town,
+    HEADERS["OTBM_WAYPOINTS"]: Waypoints,
+    HEADERS["OTBM_WAYPOINT"]: Waypoint,
+}
 
-def read_otbm(infile):
-    class Node:
-        def __init__(self, data, children):
-            data = self.remove_escape_characters(data)
-            node_type = data[0]
-
-            if node_type == HEADERS["OTBM_MAP_HEADER"]:
-                self.type = HEADERS["OTBM_MAP_HEADER"]
-                self.version, self.mapWidth, self.mapHeight, self.itemsMajorVersion, self.itemsMinorVersion = struct.unpack("<IHHII", data[1:])
-            elif node_type == HEADERS["OTBM_MAP_DATA"]:
-                self.type = HEADERS["OTBM_MAP_DATA"]
-                self.__dict__.update(read_attributes(data[1:]))
-            elif node_type == HEADERS["OTBM_TILE_AREA"]:
-                self.type = HEADERS["OTBM_TILE_AREA"]
-                self.x, self.y, self.z = struct.unpack("<HHB", data[1:6])
-            elif node_type == HEADERS["OTBM_TILE"]:
-                self.type = HEADERS["OTBM_TILE"]
-                self.x, self.y = struct.unpack("<BB", data[1:3])
-                self.__dict__.update(read_attributes(data[3:]))
-            elif node_type == HEADERS["OTBM_ITEM"]:
-                self.type = HEADERS["OTBM_ITEM"]
-                self.id, = struct.unpack("<H", data[1:3])
-                self.__dict__.update(read_attributes(data[3:]))
-            elif node_type == HEADERS["OTBM_HOUSETILE"]:
-                self.type = HEADERS["OTBM_HOUSETILE"]
-                self.x, self.y, self.houseId = struct.unpack("<BBI", data[1:7])
-                self.__dict__.update(read_attributes(data[7:]))
-            elif node_type == HEADERS["OTBM_WAYPOINTS"]:
-                self.type = HEADERS["OTBM_WAYPOINTS"]
-            elif node_type == HEADERS["OTBM_WAYPOINT"]:
-                self.type = HEADERS["OTBM_WAYPOINT"]
-                name_len = struct.unpack("<H", data[1:3])[0]
-                self.name = data[3:3 + name_len].decode("ascii")
-                self.x, self.y, self.z = struct.unpack("<HHB", data[3 + name_len:])
-            elif node_type == HEADERS["OTBM_TOWNS"]:
-                self.type = HEADERS["OTBM_TOWNS"]
-            elif node_type == HEADERS["OTBM_TOWN"]:
-                self.type = HEADERS["OTBM_TOWN"]
-                self.townid = struct.unpack("<I", data[1:5])[0]
-                name_len = struct.unpack("<H", data[5:7])[0]
-                self.name = data[7:7 + name_len].decode("ascii")
-                self.x, self.y, self.z = struct.unpack("<HHB", data[7 + name_len:])
-            else:
-                raise ValueError(f"Unknown node type: {node_type}")
-
-            self.set_children(children)
-
-        def remove_escape_characters(self, node_data):
-            i_esc = 0
-            while True:
-                index = node_data.find(NODE_ESC, i_esc)
-                if index == -1:
-                    break
-                node_data = node_data[:index] + node_data[index + 1:]
-                i_esc = index
-            return node_data
-
-        def set_children(self, children):
-            if not children:
-                return
+def extra_attribute(name):
+    def get_value(node):
+        extra = node.extra
+        if extra is None or name not in extra:
+            raise AttributeError(f"'{type(node).__name__}' object has no attribute '{name}'")
+        return extra[name]
+
+    def set_value(node, value):
+        if node.extra is None:
+            node.extra = {}
+        node.extra[name] = value
+
+    def delete_value(node):
+        get_value(node)
+        del node.extra[name]
+
+    return property(get_value, set_value, delete_value)
+
+def add_extra_attribute(name):
+    # Fields a node type has no slot for are stored in its extra dict; slots
+    # of the subclasses shadow these properties.
+    if name not in vars(Node):
+        setattr(Node, name, extra_attribute(name))
+
+def set_attributes(node, attributes):
+    for name, value in attributes.items():
+        try:
+            setattr(node, name, value)
+        except AttributeError:
+            if node.extra is None:
+                node.extra = {}
+            node.extra[name] = value
+
+for cls in NODE_CLASSES.values():
+    for name in cls.FIELDS:
+        add_extra_attribute(name)
+
+STRING_HEADER = struct.Struct("<BH")
+STRING_LENGTH = struct.Struct("<H")
+POSITION = struct.Struct("<HHB")
+MAP_HEADER = struct.Struct("<BIHHII")
+TILE_AREA = struct.Struct("<BHHB")
+TILE = struct.Struct("<BBB")
+HOUSE_TILE = struct.Struct("<BBBI")
+ITEM = struct.Struct("<BH")
+TOWN = struct.Struct("<BIH")
+WAYPOINT = struct.Struct("<BH")
+
+UNKNOWN_ATTRIBUTES = "unknownAttributes"
+add_extra_attribute(UNKNOWN_ATTRIBUTES)
+
+class AttributeCodec:
+    def __init__(self, attr_id, name, fmt=None, decode=None, encode=None, merge=None):
+        self.attr_id = attr_id
+        self.name = name
+        self.read_struct = struct.Struct(f"<{fmt}") if fmt else None
+        self.write_struct = struct.Struct(f"<B{fmt}") if fmt else None
+        self.decode = decode
+        self.encode = encode
+        self.merge = merge
+
+    def read(self, data, i):
+        if self.read_struct is None:
+            length, = STRING_LENGTH.unpack_from(data, i)
+            end = i + 2 + length
+            return data[i + 2:end].decode("ascii"), end
+
+        values = self.read_struct.unpack_from(data, i)
+        value = self.decode(*values) if self.decode else values[0]
+        return value, i + self.read_struct.size
+
+    def write(self, value):
+        if self.write_struct is None:
+            encoded = value.encode("ascii")
+            return STRING_HEADER.pack(self.attr_id, len(encoded)) + encoded
+        if self.encode:
+            return self.write_struct.pack(self.attr_id, *self.encode(value))
+        return self.write_struct.pack(self.attr_id, value)
+
+ATTRIBUTE_CODECS = {}
+ATTRIBUTE_WRITERS = {}
+
+def register_attribute(codec):
+    ATTRIBUTE_CODECS[codec.attr_id] = codec
+    order = ATTRIBUTE_WRITERS[codec.name][0] if codec.name in ATTRIBUTE_WRITERS else len(ATTRIBUTE_WRITERS)
+    ATTRIBUTE_WRITERS[codec.name] = (order, codec)
+    add_extra_attribute(codec.name)
+    return codec
+
+for codec in [
+    AttributeCodec(
+        HEADERS["OTBM_ATTR_TELE_DEST"], "destination", "HHB",
+        decode=lambda x, y, z: {"x": x, "y": y, "z": z},
+        encode=lambda destination: (destination["x"], destination["y"], destination["z"])
+    ),
+    AttributeCodec(HEADERS["OTBM_ATTR_DESCRIPTION"], "description", merge=lambda previous, value: f"{previous} {value}"),
+    AttributeCodec(HEADERS["OTBM_ATTR_UNIQUE_ID"], "uid", "H"),
+    AttributeCodec(HEADERS["OTBM_ATTR_ACTION_ID"], "aid", "H"),
+    AttributeCodec(HEADERS["OTBM_ATTR_RUNE_CHARGES"], "runeCharges", "H"),
+    AttributeCodec(HEADERS["OTBM_ATTR_EXT_SPAWN_FILE"], "spawnfile"),
+    AttributeCodec(HEADERS["OTBM_ATTR_TEXT"], "text"),
+    AttributeCodec(HEADERS["OTBM_ATTR_EXT_HOUSE_FILE"], "housefile"),
+    AttributeCodec(HEADERS["OTBM_ATTR_ITEM"], "tileid", "H"),
+    AttributeCodec(HEADERS["OTBM_ATTR_COUNT"], "count", "B"),
+    AttributeCodec(HEADERS["OTBM_ATTR_DEPOT_ID"], "depotId", "H"),
+    AttributeCodec(HEADERS["OTBM_ATTR_HOUSEDOORID"], "houseDoorId", "B"),
+    AttributeCodec(
+        HEADERS["OTBM_ATTR_TILE_FLAGS"], "zones", "I",
+        decode=lambda flags: read_flags(flags),
+        encode=lambda zones: (write_flags(zones),)
+    ),
+]:
+    register_attribute(codec)
+
+def write_map_header(node):
+    return MAP_HEADER.pack(node.type, node.version, node.mapWidth, node.mapHeight, node.itemsMajorVersion, node.itemsMinorVersion)
+
+def write_map_data(node):
+    return bytes([node.type]) + write_attributes(node)
+
+def write_tile_area(node):
+    return TILE_AREA.pack(node.type, node.x, node.y, node.z)
+
+def write_tile(node):
+    return TILE.pack(node.type, node.x, node.y) + write_attributes(node)
+
+def write_house_tile(node):
+    return HOUSE_TILE.pack(node.type, node.x, node.y, node.houseId) + write_attributes(node)
+
+def write_item(node):
+    return ITEM.pack(node.type, node.id) + write_attributes(node)
+
+def write_section(node):
+    return bytes([node.type])
+
+def write_town(node):
+    name = node.name.encode("ascii")
+    return TOWN.pack(node.type, node.townid, len(name)) + name + POSITION.pack(node.x, node.y, node.z)
+
+def write_waypoint(node):
+    name = node.name.encode("ascii")
+    return WAYPOINT.pack(node.type, len(name)) + name + POSITION.pack(node.x, node.y, node.z)
+
+NODE_WRITERS = {
+    HEADERS["OTBM_MAP_HEADER"]: write_map_header,
+    HEADERS["OTBM_MAP_DATA"]: write_map_data,
+    HEADERS["OTBM_TILE_AREA"]: write_tile_area,
+    HEADERS["OTBM_TILE"]: write_tile,
+    HEADERS["OTBM_HOUSETILE"]: write_house_tile,
+    HEADERS["OTBM_ITEM"]: write_item,
+    HEADERS["OTBM_TOWNS"]: write_section,
+    HEADERS["OTBM_TOWN"]: write_town,
+    HEADERS["OTBM_WAYPOINTS"]: write_section,
+    HEADERS["OTBM_WAYPOINT"]: write_waypoint,
+}
 
-            if self.type == HEADERS["OTBM_TILE_AREA"]:
-                self.tiles = children
-            elif self.type in [HEADERS["OTBM_TILE"], HEADERS["OTBM_HOUSETILE"]]:
-                self.items = children
-            elif self.type == HEADERS["OTBM_TOWNS"]:
-                self.towns = children
-            elif self.type == HEADERS["OTBM_ITEM"]:
-                self.content = children
-            elif self.type == HEADERS["OTBM_MAP_DATA"]:
-                self.features = children
-            else:
-                self.nodes = children
-
-    def read_ascii_string_16le(data):
-        length = struct.unpack("<H", data[:2])[0]
-        return data[2:2 + length].decode("ascii")
-
-    def read_attributes(data):
-        properties = {}
-        i = 0
-
-        while i + 1 < len(data):
-            attr_type = data[i]
-            i += 1
-
-            if attr_type == HEADERS["OTBM_ATTR_TEXT"]:
-                properties["text"] = read_ascii_string_16le(data[i:])
-                i += len(properties["text"]) + 2
-            elif attr_type == HEADERS["OTBM_ATTR_EXT_SPAWN_FILE"]:
-                properties["spawnfile"] = read_ascii_string_16le(data[i:])
-                i += len(properties["spawnfile"]) + 2
-            elif attr_type == HEADERS["OTBM_ATTR_EXT_HOUSE_FILE"]:
-                properties["housefile"] = read_ascii_string_16le(data[i:])
-                i += len(properties["housefile"]) + 2
-            elif attr_type == HEADERS["OTBM_ATTR_HOUSEDOORID"]:
-                properties["houseDoorId"] = data[i]
-                i += 1
-            elif attr_type == HEADERS["OTBM_ATTR_DESCRIPTION"]:
-                description = read_ascii_string_16le(data[i:])
-                if "description" in properties:
-                    properties["description"] += f" {description}"
-                else:
-                    properties["description"] = description
-                i += len(description) + 2
-            elif attr_type == HEADERS["OTBM_ATTR_DEPOT_ID"]:
-                properties["depotId"] = struct.unpack("<H", data[i:i + 2])[0]
-                i += 2
-            elif attr_type == HEADERS["OTBM_ATTR_TILE_FLAGS"]:
-                properties["zones"] = read_flags(struct.unpack("<I", data[i:i + 4])[0])
-                i += 4
-            elif attr_type == HEADERS["OTBM_ATTR_RUNE_CHARGES"]:
-                properties["runeCharges"] = struct.unpack("<H", data[i:i + 2])[0]
-                i += 2
-            elif attr_type == HEADERS["OTBM_ATTR_COUNT"]:
-                properties["count"] = data[i]
-                i += 1
-            elif attr_type == HEADERS["OTBM_ATTR_ITEM"]:
-                properties["tileid"] = struct.unpack("<H", data[i:i + 2])[0]
-                i += 2
-            elif attr_type == HEADERS["OTBM_ATTR_ACTION_ID"]:
-                properties["aid"] = struct.unpack("<H", data[i:i + 2])[0]
-                i += 2
-            elif attr_type == HEADERS["OTBM_ATTR_UNIQUE_ID"]:
-                properties["uid"] = struct.unpack("<H", data[i:i + 2])[0]
-                i += 2
-            elif attr_type == HEADERS["OTBM_ATTR_TELE_DEST"]:
-                properties["destination"] = {
-                    "x": struct.unpack("<H", data[i:i + 2])[0],
-                    "y": struct.unpack("<H", data[i + 2:i + 4])[0],
-                    "z": data[i + 4],
-                }
-                i += 5
-
-        return properties
-
-    def read_flags(flags):
-        return {
-            "protection": bool(flags & HEADERS["TILESTATE_PROTECTIONZONE"]),
-            "noPVP": bool(flags & HEADERS["TILESTATE_NOPVP"]),
-            "noLogout": bool(flags & HEADERS["TILESTATE_NOLOGOUT"]),
-            "PVPZone": bool(flags & HEADERS["TILESTATE_PVPZONE"]),
-            "refresh": bool(flags & HEADERS["TILESTATE_REFRESH"]),
-        }
-
-    def read_node(data):
-        data = data[1:]
-        i = 0
-        children = []
-        node_data = None
-
-        while i < len(data):
-            c_byte = data[i]
-
-            if node_data is None and (c_byte == NODE_INIT or c_byte == NODE_TERM):
-                node_data = data[:i]
-
-            if c_byte == NODE_ESC:
-                i += 2
-                continue
+class OTBMWriter:
+    def __init__(self, outfile, header, map_data, identifier=0x00000000, buffer_size=STREAM_CHUNK_SIZE):
+        if hasattr(outfile, "write"):
+            self.file = outfile
+            self.owns_file = False
+        else:
+            self.file = open(outfile, "wb", buffering=buffer_size)
+            self.owns_file = True
+
+        self.open_nodes = []
+        self.file.write(struct.pack("<I", identifier))
+        self.begin(as_node(HEADERS["OTBM_MAP_HEADER"], header))
+        self.begin(as_node(HEADERS["OTBM_MAP_DATA"], map_data))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.owns_file:
+            self.file.close()
+
+    def begin(self, node):
+        self.file.write(struct.pack("B", NODE_INIT) + write_element(node))
+        self.open_nodes.append(node.type)
+
+    def end(self, node_type=None):
+        if not self.open_nodes:
+            raise ValueError("Could not end node: no node is open.")
+        if node_type is not None and self.open_nodes[-1] != node_type:
+            raise ValueError(f"Could not end node type {node_type}: node type {self.open_nodes[-1]} is open.")
+        self.file.write(struct.pack("B", NODE_TERM))
+        self.open_nodes.pop()
+
+    def write(self, node):
+        self.file.write(write_node(node))
+
+    def copy(self, data):
+        # Already encoded (escaped) node bytes, e.g. a span of another map
+        self.file.write(data)
+
+    def expect_open(self, node_type):
+        if not self.open_nodes or self.open_nodes[-1] != node_type:
+            raise ValueError(f"Could not write node: expected open node type {node_type}.")
+
+    def begin_area(self, x, y, z):
+        self.expect_open(HEADERS["OTBM_MAP_DATA"])
+        self.begin(as_node(HEADERS["OTBM_TILE_AREA"], {"x": x, "y": y, "z": z}))
+
+    def add_tile(self, tile):
+        self.expect_open(HEADERS["OTBM_TILE_AREA"])
+        self.write(tile)
+
+    def end_area(self):
+        self.end(HEADERS["OTBM_TILE_AREA"])
+
+    def begin_towns(self):
+        self.expect_open(HEADERS["OTBM_MAP_DATA"])
+        self.begin(as_node(HEADERS["OTBM_TOWNS"], {}))
+
+    def add_town(self, town):
+        self.expect_open(HEADERS["OTBM_TOWNS"])
+        self.write(town)
+
+    def end_towns(self):
+        self.end(HEADERS["OTBM_TOWNS"])
+
+    def begin_waypoints(self):
+        self.expect_open(HEADERS["OTBM_MAP_DATA"])
+        self.begin(as_node(HEADERS["OTBM_WAYPOINTS"], {}))
+
+    def add_waypoint(self, waypoint):
+        self.expect_open(HEADERS["OTBM_WAYPOINTS"])
+        self.write(waypoint)
+
+    def end_waypoints(self):
+        self.end(HEADERS["OTBM_WAYPOINTS"])
+
+    def close(self):
+        while self.open_nodes:
+            self.end()
+        self.file.flush()
+        if self.owns_file:
+            self.file.close()
+
+def as_node(node_type, node):
+    if isinstance(node, dict):
+        return Node.create(node_type, node)
+    return node
+
+def read_attributes(data, i=0):
+    properties = {}
+    codecs = ATTRIBUTE_CODECS
+    end = len(data)
+
+    while i < end:
+        codec = codecs.get(data[i])
+        if codec is None or i + 1 == end:
+            properties[UNKNOWN_ATTRIBUTES] = data[i:].hex()
+            break
+
+        value, i = codec.read(data, i + 1)
+        if codec.merge and codec.name in properties:
+            value = codec.merge(properties[codec.name], value)
+        properties[codec.name] = value
+
+    return properties
+
+def read_map_header(node, data):
+    _, node.version, node.mapWidth, node.mapHeight, node.itemsMajorVersion, node.itemsMinorVersion = MAP_HEADER.unpack_from(data)
+
+def read_map_data(node, data):
+    set_attributes(node, read_attributes(data, 1))
+
+def read_tile_area(node, data):
+    _, node.x, node.y, node.z = TILE_AREA.unpack_from(data)
+
+def read_tile(node, data):
+    node.x = data[1]
+    node.y = data[2]
+    set_attributes(node, read_attributes(data, 3))
+
+def read_house_tile(node, data):
+    _, node.x, node.y, node.houseId = HOUSE_TILE.unpack_from(data)
+    set_attributes(node, read_attributes(data, 7))
+
+def read_item(node, data):
+    _, node.id = ITEM.unpack_from(data)
+    set_attributes(node, read_attributes(data, 3))
+
+def read_section(node, data):
+    pass
+
+def read_town(node, data):
+    _, node.townid, name_len = TOWN.unpack_from(data)
+    node.name = data[7:7 + name_len].decode("ascii")
+    node.x, node.y, node.z = POSITION.unpack_from(data, 7 + name_len)
+
+def read_waypoint(node, data):
+    _, name_len = WAYPOINT.unpack_from(data)
+    node.name = data[3:3 + name_len].decode("ascii")
+    node.x, node.y, node.z = POSITION.unpack_from(data, 3 + name_len)
+
+NODE_READERS = {
+    HEADERS["OTBM_MAP_HEADER"]: read_map_header,
+    HEADERS["OTBM_MAP_DATA"]: read_map_data,
+    HEADERS["OTBM_TILE_AREA"]: read_tile_area,
+    HEADERS["OTBM_TILE"]: read_tile,
+    HEADERS["OTBM_HOUSETILE"]: read_house_tile,
+    HEADERS["OTBM_ITEM"]: read_item,
+    HEADERS["OTBM_TOWNS"]: read_section,
+    HEADERS["OTBM_TOWN"]: read_town,
+    HEADERS["OTBM_WAYPOINTS"]: read_section,
+    HEADERS["OTBM_WAYPOINT"]: read_waypoint,
+}
 
-            if c_byte == NODE_INIT:
-                child = read_node(data[i:])
-                children.append(child["node"])
-                i += 2 + child["i"]
-                continue
+def read_flags(flags):
+    return {
+        "protection": bool(flags & HEADERS["TILESTATE_PROTECTIONZONE"]),
+        "noPVP": bool(flags & HEADERS["TILESTATE_NOPVP"]),
+        "noLogout": bool(flags & HEADERS["TILESTATE_NOLOGOUT"]),
+        "PVPZone": bool(flags & HEADERS["TILESTATE_PVPZONE"]),
+        "refresh": bool(flags & HEADERS["TILESTATE_REFRESH"]),
+    }
 
-            if c_byte == NODE_TERM:
-                return {"node": Node(node_data, children), "i": i}
+def read_node(data, start=0, node_classes=NODE_CLASSES):
+    if data[start] != NODE_INIT:
+        raise ValueError(f"Expected node start at offset {start}.")
+
+    search = NODE_CONTROL.search
+    stack = []
+    children = []
+    node_data = None
+    node_start = start + 1
+    i = node_start
+
+    while True:
+        match = search(data, i)
+        if match is None:
+            raise ValueError("Unexpected end of OTBM data: unterminated node.")
+
+        i = match.start()
+        c_byte = data[i]
+
+        if c_byte == NODE_ESC:
+            i += 2
+            continue
+
+        if node_data is None:
+            node_data = data[node_start:i]
+
+        if c_byte == NODE_INIT:
+            stack.append((node_data, children))
+            children = []
+            node_data = None
+            node_start = i + 1
+        else:
+            node = node_classes.get(node_data[0], Node)(node_data, children)
+            if not stack:
+                return node, i + 1
+            node_data, children = stack.pop()
+            children.append(node)
 
-            i += 1
+        i += 1
 
-    with open(infile, "rb") as f:
-        data = f.read()
+def read_identifier(data):
+    if len(data) < 4:
+        raise ValueError("Unknown OTBM format: file is too short.")
 
     map_identifier = struct.unpack("<I", data[:4])[0]
     if map_identifier not in [0x00000000, 0x4D42544F]:
         raise ValueError("Unknown OTBM format: unexpected magic bytes.")
 
+    return map_identifier
+
+def parse_otbm(data):
+    map_identifier = read_identifier(data)
+
     map_data = {
         "version": __VERSION__,
         "identifier": map_identifier,
-        "data": read_node(data[4:])["node"]
+        "data": read_node(data, 4)[0]
     }
 
     return map_data
+
+def read_otbm(infile):
+    with open(infile, "rb") as f:
+        data = f.read()
+
+    return parse_otbm(data)
+
+def iter_nodes(data, start=0, read=None, chunk_size=STREAM_CHUNK_SIZE):
+    # Yields (NODE_INIT, payload) once the escaped payload of a node is known
+    # and (NODE_TERM, None) when it closes. With a read callable the buffer is
+    # refilled in chunks and only the pending payload is kept across refills.
+    if data[start:start + 1] != bytes([NODE_INIT]):
+        raise ValueError(f"Expected node start at offset {start}.")
+
+    search = NODE_CONTROL.search
+    depth = 0
+    node_start = None
+    i = start
+
+    while True:
+        match = search(data, i)
+        if match is None or (match.start() == len(data) - 1 and data[-1] == NODE_ESC):
+            i = len(data) if match is None else match.start()
+            chunk = read(chunk_size) if read else b""
+            if not chunk:
+                raise ValueError("Unexpected end of OTBM data: unterminated node.")
+            keep = i if node_start is None else node_start
+            data = data[keep:] + chunk
+            i -= keep
+            if node_start is not None:
+                node_start -= keep
+            continue
+
+        i = match.start()
+        c_byte = data[i]
+
+        if c_byte == NODE_ESC:
+            i += 2
+            continue
+
+        if node_start is not None:
+            yield NODE_INIT, data[node_start:i]
+            node_start = None
+
+        if c_byte == NODE_INIT:
+            depth += 1
+            node_start = i + 1
+        else:
+            yield NODE_TERM, None
+            depth -= 1
+            if depth == 0:
+                return
+
+        i += 1
+
+def iter_otbm(source, chunk_size=STREAM_CHUNK_SIZE):
+    # Yields (event, node, parent) without building the map tree. Container
+    # nodes (header, map_data, tile_area, towns, waypoints) are yielded as soon
+    # as they open and carry no children; tiles (with their items), towns and
+    # waypoints are yielded fully decoded with their enclosing container.
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter_otbm(f, chunk_size)
+        return
+
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        data, read = source, None
+    else:
+        read = source.read
+        data = read(max(chunk_size, 5))
+
+    read_identifier(data)
+    stack = []
+
+    for token, payload in iter_nodes(data, 4, read, chunk_size):
+        if token == NODE_INIT:
+            if stack and stack[-1][1] is not None or payload[0] not in CONTAINER_NODES:
+                stack.append((payload, []))
+                continue
+
+            node = Node(payload, [])
+            yield NODE_EVENTS[node.type], node, stack[-1][0] if stack else None
+            stack.append((node, None))
+            continue
+
+        payload, children = stack.pop()
+        if children is None:
+            continue
+
+        node = Node(payload, children)
+        parent, siblings = stack[-1] if stack else (None, None)
+        if siblings is not None:
+            siblings.append(node)
+        else:
+            yield NODE_EVENTS.get(node.type, "node"), node, parent
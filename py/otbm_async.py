@@ -0,0 +1,111 @@
+import asyncio
+import contextvars
+import itertools
+import struct
+
+from otbm2json import __VERSION__, HEADERS, NODE_INIT, STREAM_CHUNK_SIZE, Node, iter_node_chunks, iter_otbm, node_attributes, read_identifier, read_node, replacing_file
+from otbm_lazy import read_payloads
+
+ASYNC_BATCH_SIZE = 1024
+
+async def run_blocking(executor, function, *args):
+    # Runs one blocking step off the event loop. A cancelled caller still
+    # waits for the step to return before the CancelledError propagates, so
+    # no worker thread is left using a file or generator that gets closed.
+    # The step runs in a copy of the caller's context, like asyncio.to_thread,
+    # so context variables (e.g. active otbm_stats blocks) carry over.
+    context = contextvars.copy_context()
+    future = asyncio.get_running_loop().run_in_executor(executor, context.run, function, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
+
+def read_features(data, offset, size):
+    # Decodes whole top-level features until about size bytes are consumed
+    nodes = []
+    end = offset + size
+    while data[offset] == NODE_INIT and offset < end:
+        node, offset = read_node(data, offset)
+        nodes.append(node)
+    return nodes, offset
+
+def write_chunks(f, chunks, size):
+    # Encodes and writes about size bytes; returns False once exhausted
+    buffer = []
+    written = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        written += len(chunk)
+        if written >= size:
+            break
+    f.write(b"".join(buffer))
+    return written >= size
+
+async def aread_otbm(infile, chunk_size=STREAM_CHUNK_SIZE, executor=None):
+    # Same result as read_otbm. The file is read and decoded in steps of
+    # chunk_size bytes on the executor, so other tasks run in between and a
+    # cancellation takes effect after the current step.
+    with await run_blocking(executor, open, infile, "rb") as f:
+        chunks = []
+        while True:
+            chunk = await run_blocking(executor, f.read, chunk_size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    data = b"".join(chunks)
+    del chunks
+
+    identifier = read_identifier(data)
+    (header, map_data), offset = read_payloads(data)
+
+    nodes = []
+    while data[offset] == NODE_INIT:
+        features, offset = await run_blocking(executor, read_features, data, offset, chunk_size)
+        nodes.extend(features)
+
+    map_data = Node.create(HEADERS["OTBM_MAP_DATA"], node_attributes(Node(map_data, [])), nodes)
+    header = Node.create(HEADERS["OTBM_MAP_HEADER"], node_attributes(Node(header, [])), [map_data])
+    return {"version": __VERSION__, "identifier": identifier, "data": header}
+
+async def awrite_otbm(outfile, data, chunk_size=STREAM_CHUNK_SIZE, executor=None):
+    # Same output as write_otbm. Encoding and writing alternate in steps of
+    # chunk_size bytes, so at most one step's output is buffered. The map goes
+    # to a temporary file that replaces outfile only once it is complete; a
+    # cancelled or failed write leaves outfile untouched. The file gets the
+    # same permissions write_otbm would give it.
+    chunks = iter_node_chunks(data["data"])
+    try:
+        with replacing_file(outfile) as temporary, await run_blocking(executor, open, temporary, "wb") as f:
+            f.write(struct.pack("<I", 0x00000000))
+            while await run_blocking(executor, write_chunks, f, chunks, chunk_size):
+                pass
+    except BaseException:
+        chunks.close()
+        raise
+
+async def aiter_otbm(source, chunk_size=STREAM_CHUNK_SIZE, batch_size=ASYNC_BATCH_SIZE, executor=None):
+    # Async iter_otbm. Events are decoded batch_size at a time, and only when
+    # the consumer asks for more: a slow consumer holds back decoding instead
+    # of letting decoded nodes pile up.
+    events = iter_otbm(source, chunk_size)
+    try:
+        while True:
+            batch = await run_blocking(executor, list, itertools.islice(events, batch_size))
+            if not batch:
+                return
+            for event in batch:
+                yield event
+    finally:
+        events.close()
+
+async def aiter_tiles(source, chunk_size=STREAM_CHUNK_SIZE, batch_size=ASYNC_BATCH_SIZE, executor=None):
+    # Yields (tile, area) with the tile's items; tile x/y are relative to the area
+    events = aiter_otbm(source, chunk_size, batch_size, executor)
+    try:
+        async for event, node, parent in events:
+            if event == "tile":
+                yield node, parent
+    finally:
+        await events.aclose()
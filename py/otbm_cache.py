@@ -0,0 +1,215 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from otbm2json import STREAM_CHUNK_SIZE, read_node, write_node
+from otbm_columnar import AREA_COLUMNS, ITEM_COLUMNS, TILE_COLUMNS, ColumnarMap
+
+CACHE_MAGIC = b"OTBC"
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".otbc"
+CACHE_HEADER = struct.Struct("<4sIQQ32sIQQQQ")
+CACHE_COLUMN = struct.Struct("<QQ")
+CACHE_ALIGNMENT = 64
+CACHE_MAX_BYTES = 1 << 30
+CACHE_MAX_ENTRIES = 64
+
+CACHE_COLUMNS = {**TILE_COLUMNS, **AREA_COLUMNS, **ITEM_COLUMNS, "item_offsets": np.int64}
+
+def default_cache_dir():
+    return os.environ.get("OTBM_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "otbm2json")
+
+def content_hash(data):
+    return hashlib.blake2b(data, digest_size=32).digest()
+
+def file_hash(infile):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(infile, "rb") as f:
+        for chunk in iter(lambda: f.read(STREAM_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.digest()
+
+def align(offset):
+    return -(-offset // CACHE_ALIGNMENT) * CACHE_ALIGNMENT
+
+def write_entry(path, columnar, source, stat, digest):
+    # Header, column directory, the aligned little-endian columns, then a JSON
+    # block for the dict-valued side tables and the OTBM bytes of the
+    # non-area features (towns, waypoints).
+    columns = [np.asarray(getattr(columnar, name), dtype=np.dtype(dtype).newbyteorder("<")) for name, dtype in CACHE_COLUMNS.items()]
+    offset = align(CACHE_HEADER.size + CACHE_COLUMN.size * len(columns))
+    directory = []
+    for values in columns:
+        directory.append((offset, len(values)))
+        offset = align(offset + values.nbytes)
+
+    positions, nodes = zip(*columnar.other_features) if columnar.other_features else ((), ())
+    meta = json.dumps({
+        "path": source,
+        "header": columnar.header,
+        "map_attributes": columnar.map_attributes,
+        "tile_attributes": list(columnar.tile_attributes.items()),
+        "item_attributes": list(columnar.item_attributes.items()),
+        "feature_positions": list(positions),
+    }).encode("utf-8")
+    features = b"".join(map(write_node, nodes))
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(CACHE_HEADER.pack(
+            CACHE_MAGIC, CACHE_VERSION, stat.st_mtime_ns, stat.st_size, digest,
+            columnar.identifier, offset, len(meta), offset + len(meta), len(features)
+        ))
+        for entry in directory:
+            f.write(CACHE_COLUMN.pack(*entry))
+        for values, (start, _) in zip(columns, directory):
+            f.write(bytes(start - f.tell()))
+            f.write(values.tobytes())
+        f.write(bytes(offset - f.tell()))
+        f.write(meta)
+        f.write(features)
+    os.replace(temporary, path)
+
+def read_entry_header(path):
+    try:
+        with open(path, "rb") as f:
+            data = f.read(CACHE_HEADER.size)
+    except FileNotFoundError:
+        return None
+
+    if len(data) < CACHE_HEADER.size:
+        return None
+    header = CACHE_HEADER.unpack(data)
+    if header[0] != CACHE_MAGIC or header[1] != CACHE_VERSION:
+        return None
+    return header
+
+def load_entry(path):
+    # Columns are views into a private (copy-on-write) mapping of the entry:
+    # nothing is copied until a column is modified, and the entry file itself
+    # is never written through.
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    _, _, _, _, _, identifier, meta_offset, meta_length, features_offset, features_length = CACHE_HEADER.unpack_from(data)
+    meta = json.loads(data[meta_offset:meta_offset + meta_length])
+
+    columnar = ColumnarMap(identifier, meta["header"], meta["map_attributes"])
+    for index, (name, dtype) in enumerate(CACHE_COLUMNS.items()):
+        offset, count = CACHE_COLUMN.unpack_from(data, CACHE_HEADER.size + index * CACHE_COLUMN.size)
+        setattr(columnar, name, np.frombuffer(data, dtype=np.dtype(dtype).newbyteorder("<"), count=count, offset=offset))
+
+    columnar.tile_attributes = dict(meta["tile_attributes"])
+    columnar.item_attributes = dict(meta["item_attributes"])
+
+    offset = features_offset
+    for position in meta["feature_positions"]:
+        node, offset = read_node(data, offset)
+        columnar.other_features.append((position, node))
+    if offset != features_offset + features_length:
+        raise ValueError("Corrupt cache entry: feature block length mismatch.")
+
+    return columnar, meta["path"]
+
+class MapCache:
+    def __init__(self, directory=None, max_bytes=CACHE_MAX_BYTES, max_entries=CACHE_MAX_ENTRIES):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+    def entry_path(self, infile):
+        key = hashlib.blake2b(os.path.abspath(infile).encode("utf-8"), digest_size=16).hexdigest()
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def load(self, infile, bypass=False):
+        # Entries are keyed by absolute path and validated by mtime and size;
+        # if those changed, the content hash decides whether the entry is still
+        # good (e.g. after a touch or a copy that preserved the bytes).
+        if bypass:
+            return ColumnarMap.from_file(infile)
+
+        source = os.path.abspath(infile)
+        path = self.entry_path(source)
+        stat = os.stat(source)
+        header = read_entry_header(path)
+
+        if header is not None:
+            fresh = header[2] == stat.st_mtime_ns and header[3] == stat.st_size
+            if not fresh and header[3] == stat.st_size and header[4] == file_hash(source):
+                self.rewrite_stat(path, header, stat)
+                fresh = True
+            if fresh:
+                try:
+                    columnar, entry_source = load_entry(path)
+                except (ValueError, KeyError, struct.error):
+                    columnar, entry_source = None, None
+                if entry_source == source:
+                    os.utime(path)
+                    return columnar
+
+        return self.store(source, path)
+
+    def store(self, source, path):
+        stat = os.stat(source)
+        with open(source, "rb") as f:
+            data = f.read()
+        columnar = ColumnarMap.from_bytes(data)
+
+        os.makedirs(self.directory, exist_ok=True)
+        write_entry(path, columnar, source, stat, content_hash(data))
+        self.evict(keep=path)
+        return columnar
+
+    def rewrite_stat(self, path, header, stat):
+        header = CACHE_HEADER.pack(header[0], header[1], stat.st_mtime_ns, stat.st_size, *header[4:])
+        with open(path, "r+b") as f:
+            f.write(header)
+
+    def entries(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        entries = []
+        for name in names:
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                entries.append((path, os.stat(path)))
+            except FileNotFoundError:
+                continue
+        return entries
+
+    def evict(self, keep=None):
+        # Least recently used first: a hit touches the entry's mtime
+        entries = sorted(self.entries(), key=lambda entry: entry[1].st_mtime_ns)
+        total = sum(stat.st_size for _, stat in entries)
+        count = len(entries)
+
+        for path, stat in entries:
+            if total <= self.max_bytes and count <= self.max_entries:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= stat.st_size
+            count -= 1
+
+    def invalidate(self, infile):
+        try:
+            os.remove(self.entry_path(infile))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        for path, _ in self.entries():
+            os.remove(path)
+
+def read_columnar_cached(infile, cache_dir=None, bypass=False):
+    return MapCache(cache_dir).load(infile, bypass)
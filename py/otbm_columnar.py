@@ -0,0 +1,425 @@
+import io
+from array import array
+
+import numpy as np
+
+from otbm2json import __VERSION__, HEADERS, OTBMWriter, Node, iter_otbm, node_attributes, read_flags, write_flags
+
+TILE_COLUMNS = {
+    "tile_type": np.uint8,
+    "x": np.uint16,
+    "y": np.uint16,
+    "z": np.uint8,
+    "tileid": np.uint16,
+    "flags": np.uint32,
+    "house_id": np.uint32,
+    "tile_area": np.int32,
+}
+
+AREA_COLUMNS = {
+    "area_x": np.uint16,
+    "area_y": np.uint16,
+    "area_z": np.uint8,
+}
+
+ITEM_COLUMNS = {
+    "item_id": np.uint16,
+    "item_depth": np.uint8,
+}
+
+ARRAY_CODES = {
+    np.uint8: "B",
+    np.uint16: "H",
+    np.uint32: "I",
+    np.int32: "i",
+    np.int64: "q",
+}
+
+ZONE_FLAGS = {
+    "protection": HEADERS["TILESTATE_PROTECTIONZONE"],
+    "noPVP": HEADERS["TILESTATE_NOPVP"],
+    "noLogout": HEADERS["TILESTATE_NOLOGOUT"],
+    "PVPZone": HEADERS["TILESTATE_PVPZONE"],
+    "refresh": HEADERS["TILESTATE_REFRESH"],
+}
+
+TILE_FIELDS = {"x", "y", "houseId", "tileid", "zones"}
+ITEM_FIELDS = {"id"}
+
+class ColumnarMap:
+    def __init__(self, identifier=0x00000000, header=None, map_attributes=None):
+        self.identifier = identifier
+        self.header = dict(header or {})
+        self.map_attributes = dict(map_attributes or {})
+        for name, dtype in {**TILE_COLUMNS, **AREA_COLUMNS, **ITEM_COLUMNS}.items():
+            setattr(self, name, np.zeros(0, dtype=dtype))
+        self.item_offsets = np.zeros(1, dtype=np.int64)
+        self.tile_attributes = {}
+        self.item_attributes = {}
+        self.other_features = []
+
+    def __len__(self):
+        return len(self.x)
+
+    @property
+    def item_count(self):
+        return len(self.item_id)
+
+    @property
+    def nbytes(self):
+        columns = [*TILE_COLUMNS, *AREA_COLUMNS, *ITEM_COLUMNS, "item_offsets"]
+        return sum(getattr(self, name).nbytes for name in columns)
+
+    @classmethod
+    def from_events(cls, events, identifier=0x00000000):
+        builder = ColumnarBuilder(cls(identifier))
+        for event, node, parent in events:
+            builder.add(event, node, parent)
+        return builder.finish()
+
+    @classmethod
+    def from_file(cls, infile):
+        with open(infile, "rb") as f:
+            identifier = int.from_bytes(f.read(4), "little")
+            f.seek(0)
+            return cls.from_events(iter_otbm(f), identifier)
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls.from_events(iter_otbm(data), int.from_bytes(data[:4], "little"))
+
+    @classmethod
+    def from_tree(cls, map_data):
+        return cls.from_events(iter_tree_events(map_data["data"]), map_data["identifier"])
+
+    @classmethod
+    def concatenate(cls, parts, identifier=0x00000000, header=None, map_attributes=None):
+        columnar = cls(identifier, header, map_attributes)
+        parts = list(parts)
+        if not parts:
+            return columnar
+
+        for name in {**TILE_COLUMNS, **AREA_COLUMNS, **ITEM_COLUMNS}:
+            setattr(columnar, name, np.concatenate([getattr(part, name) for part in parts]))
+
+        tile_areas = []
+        item_offsets = [np.zeros(1, dtype=np.int64)]
+        tiles = areas = items = features = 0
+        for part in parts:
+            tile_areas.append(part.tile_area + areas)
+            item_offsets.append(part.item_offsets[1:] + items)
+            columnar.tile_attributes.update((tile + tiles, value) for tile, value in part.tile_attributes.items())
+            columnar.item_attributes.update((item + items, value) for item, value in part.item_attributes.items())
+            columnar.other_features.extend((position + features, node) for position, node in part.other_features)
+            tiles += len(part)
+            areas += len(part.area_x)
+            items += part.item_count
+            features += len(part.area_x) + len(part.other_features)
+
+        columnar.tile_area = np.concatenate(tile_areas)
+        columnar.item_offsets = np.concatenate(item_offsets)
+        return columnar
+
+    def to_tree(self):
+        features = list(self.iter_areas())
+        for position, node in self.other_features:
+            features.insert(position, node)
+
+        map_data = Node.create(HEADERS["OTBM_MAP_DATA"], self.map_attributes, features)
+        header = Node.create(HEADERS["OTBM_MAP_HEADER"], self.header, [map_data])
+        return {"version": __VERSION__, "identifier": self.identifier, "data": header}
+
+    def write(self, outfile):
+        others = dict(self.other_features)
+        area = 0
+
+        with OTBMWriter(outfile, self.header, self.map_attributes, self.identifier) as writer:
+            for position in range(len(self.area_x) + len(others)):
+                if position in others:
+                    writer.write(others[position])
+                    continue
+                writer.begin_area(int(self.area_x[area]), int(self.area_y[area]), int(self.area_z[area]))
+                for tile in self.area_tiles(area):
+                    writer.add_tile(self.tile_node(tile))
+                writer.end_area()
+                area += 1
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        self.write(buffer)
+        return buffer.getvalue()
+
+    def tile_mask(self, mask=None):
+        if mask is None:
+            return np.ones(len(self), dtype=bool)
+        return np.asarray(mask, dtype=bool)
+
+    def item_tiles(self):
+        return np.repeat(np.arange(len(self)), np.diff(self.item_offsets))
+
+    def region(self, x0=None, y0=None, x1=None, y1=None, z=None):
+        mask = self.tile_mask()
+        if x0 is not None:
+            mask &= self.x >= x0
+        if y0 is not None:
+            mask &= self.y >= y0
+        if x1 is not None:
+            mask &= self.x <= x1
+        if y1 is not None:
+            mask &= self.y <= y1
+        if z is not None:
+            mask &= self.z == z
+        return mask
+
+    def set_ground(self, ground_id, mask=None):
+        self.tileid[self.tile_mask(mask)] = ground_id
+
+    def replace_ground(self, old_id, new_id, mask=None):
+        self.tileid[(self.tileid == old_id) & self.tile_mask(mask)] = new_id
+
+    def replace_item(self, old_id, new_id, mask=None):
+        self.item_id[(self.item_id == old_id) & self.tile_mask(mask)[self.item_tiles()]] = new_id
+
+    def set_zones(self, mask=None, **zones):
+        mask = self.tile_mask(mask)
+        for name, enabled in zones.items():
+            if enabled:
+                self.flags[mask] |= ZONE_FLAGS[name]
+            else:
+                self.flags[mask] &= ~np.uint32(ZONE_FLAGS[name])
+        for tile, attributes in self.tile_attributes.items():
+            if mask[tile]:
+                attributes.pop("zones", None)
+
+    def fill(self, ground_id, x0, y0, x1, y1, z):
+        width = x1 - x0 + 1
+        height = y1 - y0 + 1
+        existing = self.region(x0, y0, x1, y1, z)
+        covered = np.zeros(width * height, dtype=bool)
+        covered[(self.x[existing].astype(np.int64) - x0) * height + (self.y[existing] - y0)] = True
+        missing = np.flatnonzero(~covered)
+        self.add_tiles(x0 + missing // height, y0 + missing % height, z)
+        self.set_ground(ground_id, self.region(x0, y0, x1, y1, z))
+
+    def add_tiles(self, x, y, z, tileid=0):
+        x = np.asarray(x, dtype=np.uint16)
+        y = np.asarray(y, dtype=np.uint16)
+        count = len(x)
+        if not count:
+            return
+
+        z = np.broadcast_to(np.asarray(z, dtype=np.uint8), count)
+        area_x = x & 0xFF00
+        area_y = y & 0xFF00
+        area_keys = area_key(self.area_x, self.area_y, self.area_z)
+        areas = {key: area for area, key in enumerate(area_keys.tolist())}
+        keys, inverse = np.unique(area_key(area_x, area_y, z), return_inverse=True)
+        new_keys = [key for key in keys.tolist() if key not in areas]
+        for key in new_keys:
+            areas[key] = len(areas)
+
+        new_keys = np.array(new_keys, dtype=np.uint64)
+        self.area_x = np.concatenate([self.area_x, (new_keys >> 24).astype(np.uint16)])
+        self.area_y = np.concatenate([self.area_y, (new_keys >> 8 & 0xFFFF).astype(np.uint16)])
+        self.area_z = np.concatenate([self.area_z, (new_keys & 0xFF).astype(np.uint8)])
+
+        tile_area = np.array([areas[key] for key in keys.tolist()], dtype=np.int32)[inverse.reshape(-1)]
+        new_columns = {
+            "tile_type": np.full(count, HEADERS["OTBM_TILE"], dtype=np.uint8),
+            "x": x,
+            "y": y,
+            "z": z,
+            "tileid": np.broadcast_to(np.asarray(tileid, dtype=np.uint16), count),
+            "flags": np.zeros(count, dtype=np.uint32),
+            "house_id": np.zeros(count, dtype=np.uint32),
+            "tile_area": tile_area,
+        }
+        for name, dtype in TILE_COLUMNS.items():
+            setattr(self, name, np.concatenate([getattr(self, name), new_columns[name].astype(dtype)]))
+        self.item_offsets = np.concatenate([self.item_offsets, np.full(count, self.item_offsets[-1])])
+        self.reorder(np.argsort(self.tile_area, kind="stable"))
+
+    def reorder(self, order):
+        order = np.asarray(order)
+        counts = np.diff(self.item_offsets)[order]
+        starts = self.item_offsets[:-1][order]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        items = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+
+        for name in TILE_COLUMNS:
+            setattr(self, name, getattr(self, name)[order])
+        for name in ITEM_COLUMNS:
+            setattr(self, name, getattr(self, name)[items])
+        self.item_offsets = offsets
+        self.tile_attributes = remap(self.tile_attributes, order)
+        self.item_attributes = remap(self.item_attributes, items)
+
+    def scatter_items(self, item_ids, probability, mask=None, seed=None):
+        rng = np.random.default_rng(seed)
+        candidates = np.flatnonzero(self.tile_mask(mask))
+        tiles = candidates[rng.random(len(candidates)) < probability]
+        ids = rng.choice(np.asarray(item_ids, dtype=np.uint16), len(tiles))
+        self.insert_items(tiles, ids)
+        return tiles
+
+    def insert_items(self, tiles, ids):
+        tiles = np.asarray(tiles, dtype=np.int64)
+        order = np.argsort(tiles, kind="stable")
+        tiles = tiles[order]
+        positions = self.item_offsets[tiles + 1]
+        self.item_id = np.insert(self.item_id, positions, np.asarray(ids, dtype=np.uint16)[order])
+        self.item_depth = np.insert(self.item_depth, positions, 0)
+
+        added = np.zeros(len(self), dtype=np.int64)
+        np.add.at(added, tiles, 1)
+        if self.item_attributes:
+            keys = np.array(list(self.item_attributes), dtype=np.int64)
+            shifted = keys + np.searchsorted(positions, keys, side="right")
+            self.item_attributes = dict(zip(shifted.tolist(), self.item_attributes.values()))
+        self.item_offsets = self.item_offsets + np.concatenate([[0], np.cumsum(added)])
+
+    def area_tiles(self, area):
+        start, end = np.searchsorted(self.tile_area, [area, area + 1])
+        return range(start, end)
+
+    def iter_areas(self):
+        for area in range(len(self.area_x)):
+            attributes = {"x": int(self.area_x[area]), "y": int(self.area_y[area]), "z": int(self.area_z[area])}
+            tiles = [self.tile_node(tile) for tile in self.area_tiles(area)]
+            yield Node.create(HEADERS["OTBM_TILE_AREA"], attributes, tiles)
+
+    def tile_node(self, tile):
+        area = self.tile_area[tile]
+        attributes = {
+            "x": int(self.x[tile]) - int(self.area_x[area]),
+            "y": int(self.y[tile]) - int(self.area_y[area]),
+        }
+        tile_type = int(self.tile_type[tile])
+        if tile_type == HEADERS["OTBM_HOUSETILE"]:
+            attributes["houseId"] = int(self.house_id[tile])
+        if self.tileid[tile]:
+            attributes["tileid"] = int(self.tileid[tile])
+        if self.flags[tile]:
+            attributes["zones"] = read_flags(int(self.flags[tile]))
+        attributes.update(self.tile_attributes.get(tile, {}))
+        return Node.create(tile_type, attributes, self.tile_items(tile))
+
+    def tile_items(self, tile):
+        items = []
+        stack = [items]
+        nodes = []
+        for item in range(self.item_offsets[tile], self.item_offsets[tile + 1]):
+            depth = int(self.item_depth[item])
+            del stack[depth + 1:]
+            attributes = {"id": int(self.item_id[item]), **self.item_attributes.get(item, {})}
+            node = Node.create(HEADERS["OTBM_ITEM"], attributes)
+            stack[depth].append(node)
+            stack.append([])
+            nodes.append((node, stack[-1]))
+        for node, content in nodes:
+            node.set_children(content)
+        return items
+
+class ColumnarBuilder:
+    def __init__(self, columnar):
+        self.columnar = columnar
+        self.columns = {
+            name: array(ARRAY_CODES[dtype])
+            for name, dtype in {**TILE_COLUMNS, **AREA_COLUMNS, **ITEM_COLUMNS}.items()
+        }
+        self.item_offsets = array("q", [0])
+        self.containers = {}
+
+    def add(self, event, node, parent):
+        columnar = self.columnar
+        columns = self.columns
+
+        if event == "header":
+            columnar.header = node_attributes(node)
+        elif event == "map_data":
+            columnar.map_attributes = node_attributes(node)
+        elif event == "tile_area":
+            columns["area_x"].append(node.x)
+            columns["area_y"].append(node.y)
+            columns["area_z"].append(node.z)
+        elif event == "tile":
+            self.add_tile(node, parent)
+        elif parent is not None and parent.type == HEADERS["OTBM_MAP_DATA"]:
+            position = len(columns["area_x"]) + len(columnar.other_features)
+            columnar.other_features.append((position, node))
+            self.containers[id(node)] = (node, [])
+        elif id(parent) in self.containers:
+            self.containers[id(parent)][1].append(node)
+
+    def add_tile(self, tile, area):
+        columns = self.columns
+        index = len(columns["x"])
+        columns["tile_type"].append(tile.type)
+        columns["x"].append(area.x + tile.x)
+        columns["y"].append(area.y + tile.y)
+        columns["z"].append(area.z)
+        columns["tile_area"].append(len(columns["area_x"]) - 1)
+        columns["house_id"].append(getattr(tile, "houseId", 0))
+
+        tileid = getattr(tile, "tileid", 0)
+        columns["tileid"].append(tileid)
+        flags = write_flags(tile.zones) if hasattr(tile, "zones") else 0
+        columns["flags"].append(flags)
+
+        extra = {key: value for key, value in node_attributes(tile).items() if key not in TILE_FIELDS}
+        if hasattr(tile, "tileid") and not tileid:
+            extra["tileid"] = tileid
+        if hasattr(tile, "zones") and (not flags or read_flags(flags) != tile.zones):
+            extra["zones"] = tile.zones
+        if extra:
+            self.columnar.tile_attributes[index] = extra
+
+        for depth, item in iter_items(getattr(tile, "items", []), with_depth=True):
+            columns["item_id"].append(item.id)
+            columns["item_depth"].append(depth)
+            extra = {key: value for key, value in node_attributes(item).items() if key not in ITEM_FIELDS}
+            if extra:
+                self.columnar.item_attributes[len(columns["item_id"]) - 1] = extra
+        self.item_offsets.append(len(columns["item_id"]))
+
+    def finish(self):
+        columnar = self.columnar
+        for name, dtype in {**TILE_COLUMNS, **AREA_COLUMNS, **ITEM_COLUMNS}.items():
+            setattr(columnar, name, np.frombuffer(self.columns[name], dtype=dtype).copy())
+        columnar.item_offsets = np.frombuffer(self.item_offsets, dtype=np.int64).copy()
+        for node, children in self.containers.values():
+            node.set_children(children)
+        return columnar
+
+def iter_items(items, with_depth=False, depth=0):
+    for item in items:
+        yield (depth, item) if with_depth else item
+        yield from iter_items(getattr(item, "content", []), with_depth, depth + 1)
+
+def iter_tree_events(header):
+    yield "header", header, None
+    for map_data in getattr(header, "nodes", []):
+        yield "map_data", map_data, header
+        for feature in getattr(map_data, "features", []):
+            if feature.type == HEADERS["OTBM_TILE_AREA"]:
+                yield "tile_area", feature, map_data
+                for tile in getattr(feature, "tiles", []):
+                    yield "tile", tile, feature
+            else:
+                yield "feature", feature, map_data
+
+def area_key(x, y, z):
+    return np.asarray(x, dtype=np.uint64) << 24 | np.asarray(y, dtype=np.uint64) << 8 | np.asarray(z, dtype=np.uint64)
+
+def remap(attributes, order):
+    if not attributes:
+        return {}
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.arange(len(order))
+    return {inverse[key].item(): value for key, value in attributes.items()}
+
+def iter_area_events(areas):
+    for area in areas:
+        yield "tile_area", area, None
+        for tile in getattr(area, "tiles", []):
+            yield "tile", tile, area
@@ -0,0 +1,160 @@
+import mmap
+import struct
+
+from otbm2json import __VERSION__, CHILD_ATTRIBUTES, CHILD_FIELDS, CONTAINER_NODES, HEADERS, NODE_CLASSES, NODE_INIT, NODE_TERM, STREAM_CHUNK_SIZE, Node, get_child_node, node_attributes, read_identifier, read_node, replacing_file, write_element, write_node
+from otbm_lazy import read_payloads
+
+class TrackedList(list):
+    # Child list that marks its owner's tile area dirty on every mutation
+    __slots__ = ("owner",)
+
+    def __init__(self, owner, items=()):
+        super().__init__(items)
+        self.owner = owner
+
+class TrackedDict(dict):
+    # Dict-valued attribute (zones, destination) that marks its owner's tile
+    # area dirty when edited in place
+    __slots__ = ("owner",)
+
+    def __init__(self, owner, items=()):
+        super().__init__(items)
+        self.owner = owner
+
+def tracked_mutator(name, base=list):
+    method = getattr(base, name)
+
+    def mutate(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.owner.touch()
+        return result
+
+    mutate.__name__ = name
+    return mutate
+
+for name in ["append", "extend", "insert", "remove", "pop", "clear", "sort", "reverse", "__setitem__", "__delitem__", "__iadd__", "__imul__"]:
+    setattr(TrackedList, name, tracked_mutator(name))
+
+for name in ["__setitem__", "__delitem__", "__ior__", "clear", "pop", "popitem", "setdefault", "update"]:
+    setattr(TrackedDict, name, tracked_mutator(name, dict))
+
+class TrackedNode:
+    # Mixin for nodes whose changes mark the tile area they belong to as
+    # dirty. The area link, dirty flag and source span live in extra slots,
+    # outside the node's fields, so node_attributes and node_to_dict do not
+    # see them.
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        if name in CHILD_FIELDS and type(value) is list:
+            value = TrackedList(self, value)
+        elif type(value) is dict and name != "extra":
+            value = TrackedDict(self, value)
+        object.__setattr__(self, name, value)
+        self.touch()
+
+    def __delattr__(self, name):
+        object.__delattr__(self, name)
+        self.touch()
+
+    def set_children(self, children):
+        if children:
+            super().set_children(TrackedList(self, children))
+
+    def touch(self):
+        area = getattr(self, "_area", None)
+        if area is not None:
+            object.__setattr__(area, "_dirty", True)
+
+    @property
+    def dirty(self):
+        return getattr(self, "_span", None) is None or self._dirty
+
+# Each node class gets a loading variant, as built by read_node before
+# tracking starts, and a tracked variant with the same layout, so a node's
+# class can be switched in place once its area is loaded.
+LOADING_CLASSES = {
+    node_type: type(f"Loading{cls.__name__}", (cls,), {"__slots__": ("_area", "_dirty", "_span")})
+    for node_type, cls in NODE_CLASSES.items()
+}
+TRACKED_CLASSES = {
+    cls: type(f"Tracked{cls.__bases__[0].__name__}", (TrackedNode, cls), {"__slots__": ()})
+    for cls in LOADING_CLASSES.values()
+}
+
+def track_area(area, source, start, end):
+    area._span = (source, start, end)
+    area._dirty = False
+
+    stack = [area]
+    while stack:
+        node = stack.pop()
+        node._area = area
+        field = CHILD_ATTRIBUTES.get(node.type, "nodes")
+        children = getattr(node, field, None)
+        if children:
+            setattr(node, field, TrackedList(node, children))
+            stack.extend(children)
+        if node.extra:
+            for name, value in node.extra.items():
+                if type(value) is dict:
+                    node.extra[name] = TrackedDict(node, value)
+        node.__class__ = TRACKED_CLASSES[type(node)]
+
+def read_otbm_incremental(infile):
+    # Like read_otbm, but tile areas remember their escaped byte range in the
+    # (memory-mapped) source and whether anything inside them changed since.
+    with open(infile, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    identifier = read_identifier(data)
+    (header, map_data), offset = read_payloads(data)
+
+    nodes = []
+    while data[offset] == NODE_INIT:
+        start = offset
+        if data[start + 1] != HEADERS["OTBM_TILE_AREA"]:
+            node, offset = read_node(data, start)
+        else:
+            node, offset = read_node(data, start, LOADING_CLASSES)
+            track_area(node, data, start, offset)
+        nodes.append(node)
+
+    map_data = Node.create(HEADERS["OTBM_MAP_DATA"], node_attributes(Node(map_data, [])), nodes)
+    header = Node.create(HEADERS["OTBM_MAP_HEADER"], node_attributes(Node(header, [])), [map_data])
+    return {"version": __VERSION__, "identifier": identifier, "data": header}
+
+def dirty_areas(data):
+    return [
+        feature
+        for map_data in get_child_node(data["data"])
+        for feature in get_child_node(map_data)
+        if feature.type == HEADERS["OTBM_TILE_AREA"] and (not isinstance(feature, TrackedNode) or feature.dirty)
+    ]
+
+def iter_incremental_chunks(node):
+    span = getattr(node, "_span", None)
+    if span is not None and not node._dirty:
+        source, start, end = span
+        yield memoryview(source)[start:end]
+        return
+
+    if node.type not in CONTAINER_NODES:
+        yield write_node(node)
+        return
+
+    yield struct.pack("B", NODE_INIT) + write_element(node)
+    for child in get_child_node(node):
+        yield from iter_incremental_chunks(child)
+    yield struct.pack("B", NODE_TERM)
+
+def serialize_otbm_incremental(data):
+    return b"".join([struct.pack("<I", data.get("identifier", 0x00000000)), *iter_incremental_chunks(data["data"])])
+
+def write_otbm_incremental(outfile, data):
+    # Clean areas are copied from the source mapping, so the output goes to a
+    # temporary file first: writing over the source in place would truncate
+    # the pages still being copied from.
+    with replacing_file(outfile) as temporary, open(temporary, "wb", buffering=STREAM_CHUNK_SIZE) as f:
+        f.write(struct.pack("<I", data.get("identifier", 0x00000000)))
+        f.writelines(iter_incremental_chunks(data["data"]))
@@ -0,0 +1,114 @@
+from otbm2json import HEADERS, Node
+
+class MapIndex:
+    def __init__(self, map_data):
+        self.map_data = next(
+            node for node in getattr(map_data["data"], "nodes", [])
+            if node.type == HEADERS["OTBM_MAP_DATA"]
+        )
+        self.chunks = {}
+        self.areas = {}
+
+        for feature in getattr(self.map_data, "features", []):
+            if feature.type != HEADERS["OTBM_TILE_AREA"]:
+                continue
+            self.areas.setdefault((feature.x, feature.y, feature.z), feature)
+            for tile in getattr(feature, "tiles", []):
+                self.insert(feature.x + tile.x, feature.y + tile.y, feature.z, area=feature, tile=tile)
+
+    def __len__(self):
+        return sum(len(chunk) for chunk in self.chunks.values())
+
+    def __contains__(self, position):
+        return self.get(*position) is not None
+
+    def insert(self, x, y, z, area, tile):
+        chunk = self.chunks.setdefault((x >> 8, y >> 8, z), {})
+        chunk[(x & 0xFF, y & 0xFF)] = (area, tile)
+
+    def lookup(self, x, y, z):
+        chunk = self.chunks.get((x >> 8, y >> 8, z))
+        if chunk is None:
+            return None
+        return chunk.get((x & 0xFF, y & 0xFF))
+
+    def get(self, x, y, z):
+        entry = self.lookup(x, y, z)
+        return entry[1] if entry else None
+
+    def area_of(self, x, y, z):
+        entry = self.lookup(x, y, z)
+        return entry[0] if entry else None
+
+    def query(self, x0, y0, x1, y1, z=None):
+        floors = self.floors() if z is None else [z]
+        cells = (x1 - x0 + 1) * (y1 - y0 + 1)
+
+        for floor in floors:
+            for cx in range(x0 >> 8, (x1 >> 8) + 1):
+                for cy in range(y0 >> 8, (y1 >> 8) + 1):
+                    chunk = self.chunks.get((cx, cy, floor))
+                    if not chunk:
+                        continue
+                    base_x = cx << 8
+                    base_y = cy << 8
+                    if cells < len(chunk):
+                        for x in range(max(x0, base_x), min(x1, base_x + 255) + 1):
+                            for y in range(max(y0, base_y), min(y1, base_y + 255) + 1):
+                                entry = chunk.get((x & 0xFF, y & 0xFF))
+                                if entry:
+                                    yield x, y, floor, entry[1]
+                        continue
+                    for (dx, dy), (area, tile) in chunk.items():
+                        x = base_x + dx
+                        y = base_y + dy
+                        if x0 <= x <= x1 and y0 <= y <= y1:
+                            yield x, y, floor, tile
+
+    def floors(self):
+        return sorted({z for _, _, z in self.chunks})
+
+    def floor(self, z):
+        for cx, cy, floor in sorted(self.chunks):
+            if floor != z:
+                continue
+            for (dx, dy), (area, tile) in self.chunks[(cx, cy, floor)].items():
+                yield (cx << 8) + dx, (cy << 8) + dy, z, tile
+
+    def add_tile(self, x, y, z, tile):
+        self.remove_tile(x, y, z)
+        base = (x & 0xFF00, y & 0xFF00, z)
+        area = self.areas.get(base)
+        if area is None:
+            area = Node.create(HEADERS["OTBM_TILE_AREA"], {"x": base[0], "y": base[1], "z": z})
+            self.areas[base] = area
+            if not hasattr(self.map_data, "features"):
+                self.map_data.features = []
+            features = self.map_data.features
+            position = next(
+                (i for i, feature in enumerate(features) if feature.type != HEADERS["OTBM_TILE_AREA"]),
+                len(features)
+            )
+            features.insert(position, area)
+
+        tile.x = x - area.x
+        tile.y = y - area.y
+        if not hasattr(area, "tiles"):
+            area.tiles = []
+        area.tiles.append(tile)
+        self.insert(x, y, z, area=area, tile=tile)
+        return tile
+
+    def remove_tile(self, x, y, z):
+        key = (x >> 8, y >> 8, z)
+        entry = self.chunks.get(key, {}).pop((x & 0xFF, y & 0xFF), None)
+        if entry is None:
+            return None
+        if not self.chunks[key]:
+            del self.chunks[key]
+
+        area, tile = entry
+        area.tiles.remove(tile)
+        if not area.tiles:
+            del area.tiles
+        return tile
@@ -0,0 +1,227 @@
+import json
+import mmap
+import os
+import struct
+
+from otbm2json import __VERSION__, CHILD_ATTRIBUTES, CONTAINER_NODES, HEADERS, NODE_INIT, NODE_READERS, NODE_TERM, STREAM_CHUNK_SIZE, iter_nodes, read_identifier, unescape_characters, write_element
+
+JSON_ENCODER = json.JSONEncoder(separators=(",", ":"))
+JSON_BATCH_SIZE = 4096
+
+CONTAINER_DEPTHS = {
+    HEADERS["OTBM_MAP_HEADER"]: 0,
+    HEADERS["OTBM_MAP_DATA"]: 1,
+    HEADERS["OTBM_TILE_AREA"]: 2,
+    HEADERS["OTBM_TOWNS"]: 2,
+    HEADERS["OTBM_WAYPOINTS"]: 2,
+}
+
+LEAF_PARENTS = {
+    HEADERS["OTBM_TILE"]: HEADERS["OTBM_TILE_AREA"],
+    HEADERS["OTBM_HOUSETILE"]: HEADERS["OTBM_TILE_AREA"],
+    HEADERS["OTBM_TOWN"]: HEADERS["OTBM_TOWNS"],
+    HEADERS["OTBM_WAYPOINT"]: HEADERS["OTBM_WAYPOINTS"],
+}
+
+class Fields:
+    # Attribute view over a plain dict: the node codecs read into and write
+    # from JSON objects directly, without building Node instances.
+    pass
+
+def decode_fields(payload):
+    data = unescape_characters(payload)
+    reader = NODE_READERS.get(data[0])
+    if reader is None:
+        raise ValueError(f"Unknown node type: {data[0]}")
+
+    view = Fields()
+    view.type = data[0]
+    reader(view, data)
+    return view.__dict__
+
+def encode_fields(fields):
+    view = Fields()
+    view.__dict__ = fields
+    return write_element(view)
+
+def child_field(fields):
+    return CHILD_ATTRIBUTES.get(fields["type"], "nodes")
+
+def read_tokens(source, chunk_size=STREAM_CHUNK_SIZE):
+    # Identifier and iter_nodes token stream of bytes, an mmap or a binary file
+    if isinstance(source, (bytes, bytearray, mmap.mmap)):
+        data, read = source, None
+    else:
+        read = source.read
+        data = read(max(chunk_size, 5))
+
+    return read_identifier(data), iter_nodes(data, 4, read, chunk_size)
+
+def children_chunk(stack, chunk):
+    parent = stack[-1]
+    if parent[1]:
+        return "," + chunk
+    parent[1] = True
+    return f',"{parent[0]}":[' + chunk
+
+def iter_json_chunks(source, chunk_size=STREAM_CHUNK_SIZE):
+    # Streams the OTBM.json document straight from the node tokens. Container
+    # nodes are written as they open and closed on NODE_TERM; tiles, towns and
+    # waypoints are collected with their items and encoded in batches.
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter_json_chunks(f, chunk_size)
+        return
+
+    encode = JSON_ENCODER.encode
+    identifier, tokens = read_tokens(source, chunk_size)
+    yield f'{{"version":{encode(__VERSION__)},"identifier":{identifier},"data":'
+
+    stack = []
+    leaves = []
+    pending = []
+
+    for token, payload in tokens:
+        if token == NODE_INIT:
+            fields = decode_fields(payload)
+            if leaves:
+                parent = leaves[-1]
+                parent.setdefault(child_field(parent), []).append(fields)
+                leaves.append(fields)
+            elif fields["type"] in CONTAINER_NODES or not stack:
+                if pending:
+                    yield children_chunk(stack, encode(pending)[1:-1])
+                    pending = []
+                chunk = encode(fields)[:-1]
+                yield children_chunk(stack, chunk) if stack else chunk
+                stack.append([child_field(fields), False])
+            else:
+                leaves.append(fields)
+            continue
+
+        if leaves:
+            fields = leaves.pop()
+            if not leaves:
+                pending.append(fields)
+                if len(pending) >= JSON_BATCH_SIZE:
+                    yield children_chunk(stack, encode(pending)[1:-1])
+                    pending = []
+            continue
+
+        if pending:
+            yield children_chunk(stack, encode(pending)[1:-1])
+            pending = []
+        yield "]}" if stack.pop()[1] else "}"
+
+    yield "}"
+
+def iter_ndjson_lines(source, chunk_size=STREAM_CHUNK_SIZE):
+    # One line per container node (without children) as it opens and one per
+    # tile, town or waypoint with its items, in file order. The first line
+    # carries the version and identifier.
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield from iter_ndjson_lines(f, chunk_size)
+        return
+
+    encode = JSON_ENCODER.encode
+    identifier, tokens = read_tokens(source, chunk_size)
+    yield encode({"version": __VERSION__, "identifier": identifier}) + "\n"
+
+    stack = []
+    for token, payload in tokens:
+        if token == NODE_INIT:
+            fields = decode_fields(payload)
+            parent = stack[-1] if stack else None
+            if parent is not None:
+                parent.setdefault(child_field(parent), []).append(fields)
+                stack.append(fields)
+            elif fields["type"] in CONTAINER_NODES:
+                yield encode(fields) + "\n"
+                stack.append(None)
+            else:
+                stack.append(fields)
+            continue
+
+        fields = stack.pop()
+        if fields is not None and (not stack or stack[-1] is None):
+            yield encode(fields) + "\n"
+
+def otbm_to_json(infile, outfile, chunk_size=STREAM_CHUNK_SIZE):
+    with open(outfile, "w", buffering=STREAM_CHUNK_SIZE) as f:
+        f.writelines(iter_json_chunks(infile, chunk_size))
+
+def otbm_to_ndjson(infile, outfile, chunk_size=STREAM_CHUNK_SIZE):
+    with open(outfile, "w", buffering=STREAM_CHUNK_SIZE) as f:
+        f.writelines(iter_ndjson_lines(infile, chunk_size))
+
+def encode_node(fields):
+    return b"".join([
+        struct.pack("B", NODE_INIT),
+        encode_fields(fields),
+        *map(encode_node, fields.get(child_field(fields), ())),
+        struct.pack("B", NODE_TERM),
+    ])
+
+def iter_document_chunks(fields):
+    if fields["type"] not in CONTAINER_NODES:
+        yield encode_node(fields)
+        return
+
+    yield struct.pack("B", NODE_INIT) + encode_fields(fields)
+    for child in fields.get(child_field(fields), ()):
+        yield from iter_document_chunks(child)
+    yield struct.pack("B", NODE_TERM)
+
+def iter_otbm_chunks(document):
+    # JSON document (as loaded by json.load) to OTBM chunks
+    yield struct.pack("<I", document.get("identifier", 0x00000000))
+    yield from iter_document_chunks(document["data"])
+
+def iter_ndjson_chunks(lines):
+    # NDJSON lines (as written by iter_ndjson_lines) to OTBM chunks. Containers
+    # stay open until a container of the same or a lower depth starts.
+    lines = iter(lines)
+    meta = json.loads(next(lines))
+    yield struct.pack("<I", meta.get("identifier", 0x00000000))
+
+    open_nodes = []
+    for line in lines:
+        if not line.strip():
+            continue
+
+        fields = json.loads(line)
+        node_type = fields["type"]
+        if node_type in CONTAINER_DEPTHS:
+            depth = CONTAINER_DEPTHS[node_type]
+            if len(open_nodes) < depth:
+                raise ValueError(f"Could not write node type {node_type}: its parent node is not open.")
+            while len(open_nodes) > depth:
+                open_nodes.pop()
+                yield struct.pack("B", NODE_TERM)
+            yield struct.pack("B", NODE_INIT) + encode_fields(fields)
+            open_nodes.append(node_type)
+            continue
+
+        parent = LEAF_PARENTS.get(node_type)
+        if parent is None:
+            while len(open_nodes) > 2:
+                open_nodes.pop()
+                yield struct.pack("B", NODE_TERM)
+            parent = HEADERS["OTBM_MAP_DATA"]
+        if not open_nodes or open_nodes[-1] != parent:
+            raise ValueError(f"Could not write node type {node_type}: expected open node type {parent}.")
+        yield encode_node(fields)
+
+    yield struct.pack("B", NODE_TERM) * len(open_nodes)
+
+def json_to_otbm(infile, outfile):
+    with open(infile) as f:
+        document = json.load(f)
+
+    with open(outfile, "wb", buffering=STREAM_CHUNK_SIZE) as f:
+        f.writelines(iter_otbm_chunks(document))
+
+def ndjson_to_otbm(infile, outfile):
+    with open(infile) as f, open(outfile, "wb", buffering=STREAM_CHUNK_SIZE) as out:
+        out.writelines(iter_ndjson_chunks(f))
@@ -0,0 +1,189 @@
+import mmap
+import os
+import struct
+
+from otbm2json import __VERSION__, HEADERS, NODE_CONTROL, NODE_ESC, NODE_INIT, Node, node_attributes, read_identifier, read_node, unescape_characters
+
+SIDECAR_MAGIC = b"OTBX"
+SIDECAR_VERSION = 1
+SIDECAR_HEADER = struct.Struct("<4sIQQI")
+SIDECAR_ENTRY = struct.Struct("<BQQHHB")
+
+class FeatureEntry:
+    def __init__(self, type, start, end, x=0, y=0, z=0):
+        self.type = type
+        self.start = start
+        self.end = end
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def overlaps(self, x0, y0, x1, y1, z0, z1):
+        return (
+            self.type == HEADERS["OTBM_TILE_AREA"]
+            and self.x <= x1 and self.x + 255 >= x0
+            and self.y <= y1 and self.y + 255 >= y0
+            and z0 <= self.z <= z1
+        )
+
+def scan_features(data):
+    # Structural pass: walks the control bytes once and decodes only the
+    # payloads of the header, the map data node and its direct children.
+    if data[4:5] != bytes([NODE_INIT]):
+        raise ValueError("Expected node start at offset 4.")
+
+    search = NODE_CONTROL.search
+    payloads = [None, None]
+    features = []
+    depth = 0
+    start = None
+    payload_start = None
+    i = 4
+
+    while True:
+        match = search(data, i)
+        if match is None:
+            raise ValueError("Unexpected end of OTBM data: unterminated node.")
+
+        i = match.start()
+        c_byte = data[i]
+
+        if c_byte == NODE_ESC:
+            i += 2
+            continue
+
+        if payload_start is not None:
+            payload = unescape_characters(data[payload_start:i])
+            if depth < 3:
+                payloads[depth - 1] = payload
+            else:
+                features.append((payload, start))
+            payload_start = None
+
+        if c_byte == NODE_INIT:
+            depth += 1
+            if depth <= 3:
+                start = i
+                payload_start = i + 1
+        else:
+            if depth == 3:
+                payload, start = features[-1]
+                features[-1] = feature_entry(payload, start, i + 1)
+            depth -= 1
+            if depth == 0:
+                return payloads, features
+
+        i += 1
+
+def feature_entry(payload, start, end):
+    if payload[0] == HEADERS["OTBM_TILE_AREA"]:
+        return FeatureEntry(payload[0], start, end, *struct.unpack("<HHB", payload[1:6]))
+    return FeatureEntry(payload[0], start, end)
+
+def read_payloads(data):
+    # Only locates the header and map data payloads; returns them with the
+    # offset of the control byte that ends the map data payload, which is
+    # where its first feature (or its terminator) starts.
+    search = NODE_CONTROL.search
+    payloads = []
+    i = 5
+    start = 5
+    while True:
+        i = search(data, i).start()
+        if data[i] == NODE_ESC:
+            i += 2
+            continue
+        payloads.append(unescape_characters(data[start:i]))
+        if len(payloads) == 2:
+            return payloads, i
+        i += 1
+        start = i
+
+def sidecar_path(infile):
+    return f"{infile}.idx"
+
+def read_sidecar(path, stat):
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(data) < SIDECAR_HEADER.size:
+        return None
+
+    magic, version, size, mtime, count = SIDECAR_HEADER.unpack_from(data)
+    if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION or size != stat.st_size or mtime != stat.st_mtime_ns:
+        return None
+    if len(data) != SIDECAR_HEADER.size + count * SIDECAR_ENTRY.size:
+        return None
+
+    return [
+        FeatureEntry(*entry)
+        for entry in SIDECAR_ENTRY.iter_unpack(data[SIDECAR_HEADER.size:])
+    ]
+
+def write_sidecar(path, stat, features):
+    with open(path, "wb") as f:
+        f.write(SIDECAR_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, stat.st_size, stat.st_mtime_ns, len(features)))
+        for entry in features:
+            f.write(SIDECAR_ENTRY.pack(entry.type, entry.start, entry.end, entry.x, entry.y, entry.z))
+
+class LazyMap:
+    def __init__(self, infile, sidecar=False):
+        self.file = open(infile, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identifier = read_identifier(self.data)
+
+        stat = os.fstat(self.file.fileno())
+        path = sidecar_path(infile) if sidecar is True else sidecar
+        features = read_sidecar(path, stat) if path else None
+
+        if features is None:
+            (header, map_data), features = scan_features(self.data)
+            if path:
+                write_sidecar(path, stat, features)
+        else:
+            header, map_data = self.read_payloads()
+
+        self.header = Node(header, [])
+        self.map_data = Node(map_data, [])
+        self.features = features
+        self.areas = [entry for entry in features if entry.type == HEADERS["OTBM_TILE_AREA"]]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def read_payloads(self):
+        return read_payloads(self.data)[0]
+
+    def read_feature(self, entry):
+        return read_node(self.data, entry.start)[0]
+
+    def iter_areas(self, x0=0, y0=0, x1=0xFFFF, y1=0xFFFF, z0=0, z1=15):
+        for entry in self.areas:
+            if entry.overlaps(x0, y0, x1, y1, z0, z1):
+                yield self.read_feature(entry)
+
+    def read_region(self, x0=0, y0=0, x1=0xFFFF, y1=0xFFFF, z0=0, z1=15):
+        features = list(self.iter_areas(x0, y0, x1, y1, z0, z1))
+        features.extend(
+            self.read_feature(entry)
+            for entry in self.features
+            if entry.type != HEADERS["OTBM_TILE_AREA"]
+        )
+
+        map_data = Node.create(HEADERS["OTBM_MAP_DATA"], node_attributes(self.map_data), features)
+        header = Node.create(HEADERS["OTBM_MAP_HEADER"], node_attributes(self.header), [map_data])
+        return {"version": __VERSION__, "identifier": self.identifier, "data": header}
+
+def read_otbm_region(infile, x0=0, y0=0, x1=0xFFFF, y1=0xFFFF, z0=0, z1=15, sidecar=False):
+    with LazyMap(infile, sidecar) as lazy_map:
+        return lazy_map.read_region(x0, y0, x1, y1, z0, z1)
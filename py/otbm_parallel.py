@@ -0,0 +1,183 @@
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from otbm2json import __VERSION__, HEADERS, NODE_INIT, NODE_TERM, Node, get_child_node, node_attributes, read_identifier, read_node, read_otbm, write_element, write_node
+from otbm_lazy import scan_features
+
+PARALLEL_MIN_SIZE = 8 << 20
+BATCHES_PER_WORKER = 4
+PARALLEL_MIN_AREAS = 2
+
+worker_data = None
+worker_features = None
+
+def init_serializer(features):
+    global worker_features
+    worker_features = features
+
+def init_worker(infile):
+    global worker_data
+    with open(infile, "rb") as f:
+        worker_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def decode_areas(starts):
+    return [read_node(worker_data, start)[0] for start in starts]
+
+def decode_columnar_areas(starts):
+    from otbm_columnar import ColumnarMap, iter_area_events
+    return ColumnarMap.from_events(iter_area_events(decode_areas(starts)))
+
+def batch_areas(entries, batch_size):
+    batch = []
+    size = 0
+    for entry in entries:
+        batch.append(entry.start)
+        size += entry.end - entry.start
+        if size >= batch_size:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+def decode_parallel(infile, workers, decode):
+    with open(infile, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        identifier = read_identifier(data)
+        (header, map_data), features = scan_features(data)
+
+        areas = [entry for entry in features if entry.type == HEADERS["OTBM_TILE_AREA"]]
+        area_bytes = sum(entry.end - entry.start for entry in areas)
+        batch_size = max(1, area_bytes // (workers * BATCHES_PER_WORKER))
+
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(infile,)) as executor:
+            batches = list(executor.map(decode, batch_areas(areas, batch_size)))
+
+        others = [
+            (position, read_node(data, entry.start)[0])
+            for position, entry in enumerate(features)
+            if entry.type != HEADERS["OTBM_TILE_AREA"]
+        ]
+
+    return identifier, Node(header, []), Node(map_data, []), batches, others
+
+def read_otbm_parallel(infile, workers=None, min_size=PARALLEL_MIN_SIZE):
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or os.path.getsize(infile) < min_size:
+        return read_otbm(infile)
+
+    identifier, header, map_data, batches, others = decode_parallel(infile, workers, decode_areas)
+
+    children = [area for batch in batches for area in batch]
+    for position, node in others:
+        children.insert(position, node)
+
+    map_data = Node.create(HEADERS["OTBM_MAP_DATA"], node_attributes(map_data), children)
+    header = Node.create(HEADERS["OTBM_MAP_HEADER"], node_attributes(header), [map_data])
+    return {"version": __VERSION__, "identifier": identifier, "data": header}
+
+def read_columnar_parallel(infile, workers=None, min_size=PARALLEL_MIN_SIZE):
+    from otbm_columnar import ColumnarMap
+
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or os.path.getsize(infile) < min_size:
+        return ColumnarMap.from_file(infile)
+
+    identifier, header, map_data, batches, others = decode_parallel(infile, workers, decode_columnar_areas)
+
+    columnar = ColumnarMap.concatenate(batches, identifier, node_attributes(header), node_attributes(map_data))
+    columnar.other_features = others
+    return columnar
+
+def serialize_nodes(nodes):
+    return b"".join(map(write_node, nodes))
+
+def default_executor():
+    gil_enabled = getattr(sys, "_is_gil_enabled", lambda: True)()
+    return "process" if gil_enabled else "thread"
+
+def serialization_jobs(features, batch_tiles):
+    # (start, end) ranges of features: runs of tile areas holding about
+    # batch_tiles tiles, other features on their own
+    start = 0
+    tiles = 0
+    for end, feature in enumerate(features):
+        if feature.type != HEADERS["OTBM_TILE_AREA"]:
+            if start < end:
+                yield start, end
+            yield end, end + 1
+            start = end + 1
+            tiles = 0
+            continue
+        tiles += len(getattr(feature, "tiles", []))
+        if tiles >= batch_tiles:
+            yield start, end + 1
+            start = end + 1
+            tiles = 0
+    if start < len(features):
+        yield start, len(features)
+
+def serialize_range(bounds):
+    start, end = bounds
+    return serialize_nodes(worker_features[start:end])
+
+def serialize_features(features, jobs, workers, executor):
+    # Process workers are forked with the tree as their initializer argument,
+    # so they inherit it and only receive index ranges; pickling the tile
+    # areas to send them costs about as much as serializing them. Forking a
+    # process that runs other threads (e.g. an asyncio service's executor)
+    # can deadlock the child on a lock held by one of them, so threads are
+    # used instead then.
+    if executor == "process" and threading.active_count() > 1:
+        executor = "thread"
+    if executor != "process":
+        with ThreadPoolExecutor(workers) as pool:
+            yield from pool.map(serialize_nodes, (features[start:end] for start, end in jobs))
+        return
+    if "fork" not in multiprocessing.get_all_start_methods():
+        yield serialize_nodes(features)
+        return
+
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_serializer, initargs=(features,)) as pool:
+        yield from pool.map(serialize_range, list(jobs))
+
+def iter_serialized_chunks(data, workers=None, executor=None):
+    workers = workers or os.cpu_count() or 1
+    executor = executor or default_executor()
+    header = data["data"]
+    map_data = get_child_node(header)
+
+    yield struct.pack("<I", 0x00000000)
+    yield struct.pack("B", NODE_INIT) + write_element(header)
+
+    for child in map_data:
+        if child.type != HEADERS["OTBM_MAP_DATA"]:
+            yield write_node(child)
+            continue
+
+        features = get_child_node(child)
+        areas = [feature for feature in features if feature.type == HEADERS["OTBM_TILE_AREA"]]
+        yield struct.pack("B", NODE_INIT) + write_element(child)
+
+        if workers == 1 or len(areas) < PARALLEL_MIN_AREAS:
+            yield serialize_nodes(features)
+        else:
+            tiles = sum(len(getattr(area, "tiles", [])) for area in areas)
+            batch_tiles = max(1, tiles // (workers * BATCHES_PER_WORKER))
+            yield from serialize_features(features, serialization_jobs(features, batch_tiles), workers, executor)
+
+        yield struct.pack("B", NODE_TERM)
+
+    yield struct.pack("B", NODE_TERM)
+
+def serialize_otbm_parallel(data, workers=None, executor=None):
+    return b"".join(iter_serialized_chunks(data, workers, executor))
+
+def write_otbm_parallel(outfile, data, workers=None, executor=None):
+    with open(outfile, "wb") as f:
+        f.writelines(iter_serialized_chunks(data, workers, executor))
@@ -0,0 +1,268 @@
+import mmap
+import struct
+
+from otbm2json import HEADERS, Node, OTBMWriter, get_child_node, node_attributes, read_node, replacing_file, write_node
+from otbm_lazy import LazyMap
+
+PATCH_MAGIC = b"OTBP"
+PATCH_VERSION = 1
+PATCH_HEADER = struct.Struct("<4sII")
+PATCH_RECORD = struct.Struct("<BHHBI")
+
+PATCH_OPS = {
+    "PATCH_MAP_HEADER": 0x00,
+    "PATCH_TILE_ADD": 0x01,
+    "PATCH_TILE_CHANGE": 0x02,
+    "PATCH_TILE_REMOVE": 0x03,
+    "PATCH_TOWN_SET": 0x04,
+    "PATCH_TOWN_REMOVE": 0x05,
+    "PATCH_WAYPOINT_SET": 0x06,
+    "PATCH_WAYPOINT_REMOVE": 0x07,
+}
+
+SECTION_OPS = {
+    HEADERS["OTBM_TOWNS"]: (PATCH_OPS["PATCH_TOWN_SET"], PATCH_OPS["PATCH_TOWN_REMOVE"]),
+    HEADERS["OTBM_WAYPOINTS"]: (PATCH_OPS["PATCH_WAYPOINT_SET"], PATCH_OPS["PATCH_WAYPOINT_REMOVE"]),
+}
+
+def chunk_keys(entry):
+    # 256x256 chunks of absolute coordinates a tile area can hold tiles in
+    return [
+        (cx, cy, entry.z)
+        for cx in range(entry.x >> 8, (min(entry.x + 255, 0xFFFF) >> 8) + 1)
+        for cy in range(entry.y >> 8, (min(entry.y + 255, 0xFFFF) >> 8) + 1)
+    ]
+
+def index_chunks(lazy_map):
+    chunks = {}
+    for entry in lazy_map.areas:
+        for key in chunk_keys(entry):
+            chunks.setdefault(key, []).append(entry)
+    return chunks
+
+def section_key(node):
+    return node.townid if node.type == HEADERS["OTBM_TOWN"] else node.name
+
+def encode_tile(tile, x, y):
+    # Tiles are compared and stored with chunk-relative coordinates, so the
+    # same tile in differently aligned areas encodes the same
+    tile.x = x & 0xFF
+    tile.y = y & 0xFF
+    return write_node(tile)
+
+def read_chunk(lazy_map, entries, key):
+    cx, cy, z = key
+    tiles = {}
+    for entry in entries:
+        area = lazy_map.read_feature(entry)
+        for tile in get_child_node(area):
+            x = area.x + tile.x
+            y = area.y + tile.y
+            if x >> 8 == cx and y >> 8 == cy:
+                tiles[(x, y)] = encode_tile(tile, x, y)
+    return tiles
+
+def read_sections(lazy_map):
+    sections = {node_type: {} for node_type in SECTION_OPS}
+    for entry in lazy_map.features:
+        if entry.type in sections:
+            for node in get_child_node(lazy_map.read_feature(entry)):
+                sections[entry.type][section_key(node)] = node
+    return sections
+
+def patch_record(op, x=0, y=0, z=0, payload=b""):
+    return PATCH_RECORD.pack(op, x, y, z, len(payload)) + payload
+
+def iter_patch_chunks(old, new):
+    # Walks both maps one 256x256 chunk at a time, in sorted chunk order;
+    # only the area index and the tiles of the current chunk are in memory.
+    with LazyMap(old) as before, LazyMap(new) as after:
+        yield PATCH_HEADER.pack(PATCH_MAGIC, PATCH_VERSION, after.identifier)
+
+        map_data = Node.create(HEADERS["OTBM_MAP_DATA"], node_attributes(after.map_data))
+        header = Node.create(HEADERS["OTBM_MAP_HEADER"], node_attributes(after.header), [map_data])
+        yield patch_record(PATCH_OPS["PATCH_MAP_HEADER"], payload=write_node(header))
+
+        old_chunks = index_chunks(before)
+        new_chunks = index_chunks(after)
+        for key in sorted(old_chunks.keys() | new_chunks.keys()):
+            old_tiles = read_chunk(before, old_chunks.get(key, []), key)
+            new_tiles = read_chunk(after, new_chunks.get(key, []), key)
+            records = []
+            for x, y in sorted(old_tiles.keys() | new_tiles.keys()):
+                old_tile = old_tiles.get((x, y))
+                new_tile = new_tiles.get((x, y))
+                if new_tile is None:
+                    records.append(patch_record(PATCH_OPS["PATCH_TILE_REMOVE"], x, y, key[2]))
+                elif old_tile is None:
+                    records.append(patch_record(PATCH_OPS["PATCH_TILE_ADD"], x, y, key[2], new_tile))
+                elif old_tile != new_tile:
+                    records.append(patch_record(PATCH_OPS["PATCH_TILE_CHANGE"], x, y, key[2], new_tile))
+            if records:
+                yield b"".join(records)
+
+        old_sections = read_sections(before)
+        new_sections = read_sections(after)
+        for node_type, (set_op, remove_op) in SECTION_OPS.items():
+            old_nodes = old_sections[node_type]
+            new_nodes = new_sections[node_type]
+            for key, node in old_nodes.items():
+                if key not in new_nodes:
+                    yield patch_record(remove_op, node.x, node.y, node.z, write_node(node))
+            for key, node in new_nodes.items():
+                payload = write_node(node)
+                if key not in old_nodes or write_node(old_nodes[key]) != payload:
+                    yield patch_record(set_op, node.x, node.y, node.z, payload)
+
+def diff_otbm(old, new, outfile=None):
+    if outfile is None:
+        return b"".join(iter_patch_chunks(old, new))
+
+    with open(outfile, "wb") as f:
+        f.writelines(iter_patch_chunks(old, new))
+
+def iter_patch_records(data):
+    magic, version, identifier = PATCH_HEADER.unpack_from(data)
+    if magic != PATCH_MAGIC or version != PATCH_VERSION:
+        raise ValueError("Unknown OTBM patch format: unexpected magic bytes or version.")
+
+    offset = PATCH_HEADER.size
+    while offset < len(data):
+        op, x, y, z, length = PATCH_RECORD.unpack_from(data, offset)
+        offset += PATCH_RECORD.size
+        yield op, x, y, z, offset, offset + length
+        offset += length
+
+class PatchReader:
+    # Indexes a patch by chunk without decoding its tiles; the tile records of
+    # a chunk are decoded when the first area overlapping it is written.
+    def __init__(self, data):
+        self.data = data
+        self.identifier = PATCH_HEADER.unpack_from(data)[2]
+        self.chunks = {}
+        self.sections = {node_type: [] for node_type in SECTION_OPS}
+        self.loaded = {}
+
+        section_types = {op: node_type for node_type, ops in SECTION_OPS.items() for op in ops}
+        for op, x, y, z, start, end in iter_patch_records(data):
+            if op == PATCH_OPS["PATCH_MAP_HEADER"]:
+                self.header = read_node(data, start)[0]
+            elif op in section_types:
+                node = read_node(data, start)[0] if start < end else None
+                self.sections[section_types[op]].append((op, node))
+            else:
+                key = (x >> 8, y >> 8, z)
+                first, _ = self.chunks.get(key, (start - PATCH_RECORD.size, None))
+                self.chunks[key] = (first, end)
+
+    def chunk_ops(self, key):
+        ops = self.loaded.get(key)
+        if ops is None:
+            ops = self.loaded[key] = {}
+            if key in self.chunks:
+                first, last = self.chunks[key]
+                for op, x, y, z, start, end in iter_patch_records_range(self.data, first, last):
+                    ops[(x, y, z)] = (op, read_node(self.data, start)[0] if start < end else None)
+        return ops
+
+    def remaining(self):
+        # Additions that no existing tile area covered
+        for key in sorted(self.chunks.keys() | self.loaded.keys()):
+            for (x, y, z), (op, tile) in sorted(self.chunk_ops(key).items()):
+                if op != PATCH_OPS["PATCH_TILE_REMOVE"]:
+                    yield x, y, z, tile
+
+def iter_patch_records_range(data, offset, end):
+    while offset < end:
+        op, x, y, z, length = PATCH_RECORD.unpack_from(data, offset)
+        offset += PATCH_RECORD.size
+        yield op, x, y, z, offset, offset + length
+        offset += length
+
+def patch_area(area, patch):
+    # Existing tiles are replaced or removed in place; additions inside the
+    # area's bounds are appended. Applied operations are consumed.
+    x0, y0, z = area.x, area.y, area.z
+    chunks = {(cx, cy, z): patch.chunk_ops((cx, cy, z)) for cx, cy, _ in chunk_keys(area)}
+    tiles = []
+
+    for tile in get_child_node(area):
+        x = x0 + tile.x
+        y = y0 + tile.y
+        entry = chunks[(x >> 8, y >> 8, z)].pop((x, y, z), None)
+        if entry is None:
+            tiles.append(tile)
+        elif entry[1] is not None:
+            tiles.append(place_tile(entry[1], x - x0, y - y0))
+
+    for ops in chunks.values():
+        for (x, y, tile_z), (op, tile) in sorted(ops.items()):
+            if op != PATCH_OPS["PATCH_TILE_REMOVE"] and x0 <= x <= x0 + 255 and y0 <= y <= y0 + 255:
+                tiles.append(place_tile(tile, x - x0, y - y0))
+                del ops[(x, y, tile_z)]
+
+    return tiles
+
+def place_tile(tile, x, y):
+    tile.x = x
+    tile.y = y
+    return tile
+
+def patch_section(node_type, nodes, patch):
+    nodes = {section_key(node): node for node in nodes}
+    set_op, _ = SECTION_OPS[node_type]
+    for op, node in patch.sections[node_type]:
+        if op == set_op:
+            nodes[section_key(node)] = node
+        else:
+            nodes.pop(section_key(node), None)
+    return list(nodes.values())
+
+def apply_patch(old, patch, outfile):
+    # Streams the old map one feature at a time from its memory map; memory
+    # holds the feature index, the current tile area and the patch index. The
+    # result goes to a temporary file that replaces outfile once complete, so
+    # old may be outfile itself.
+    with open(patch, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        patch = PatchReader(data)
+        map_data = get_child_node(patch.header)[0]
+
+        with LazyMap(old) as source, replacing_file(outfile) as temporary, OTBMWriter(temporary, patch.header, map_data, patch.identifier) as writer:
+            for entry in source.areas:
+                area = source.read_feature(entry)
+                tiles = patch_area(area, patch)
+                if not tiles:
+                    continue
+                writer.begin_area(area.x, area.y, area.z)
+                for tile in tiles:
+                    writer.add_tile(tile)
+                writer.end_area()
+
+            area = None
+            for x, y, z, tile in patch.remaining():
+                if area != (x & 0xFF00, y & 0xFF00, z):
+                    if area is not None:
+                        writer.end_area()
+                    area = (x & 0xFF00, y & 0xFF00, z)
+                    writer.begin_area(*area)
+                writer.add_tile(place_tile(tile, x & 0xFF, y & 0xFF))
+            if area is not None:
+                writer.end_area()
+
+            written = set()
+            for entry in source.features:
+                if entry.type == HEADERS["OTBM_TILE_AREA"]:
+                    continue
+                node = source.read_feature(entry)
+                if node.type in SECTION_OPS:
+                    written.add(node.type)
+                    children = patch_section(node.type, get_child_node(node), patch)
+                    if get_child_node(node) and not children:
+                        continue
+                    node = Node.create(node.type, node_attributes(node), children)
+                writer.write(node)
+
+            for node_type in SECTION_OPS:
+                nodes = patch_section(node_type, [], patch)
+                if node_type not in written and nodes:
+                    writer.write(Node.create(node_type, {}, nodes))
@@ -0,0 +1,122 @@
+import os
+
+from otbm2json import HEADERS, Node, OTBMWriter, node_attributes, replacing_file
+from otbm_lazy import LazyMap
+from otbm_patch import index_chunks, read_chunk, read_sections
+
+REGION_NAME = "{name}.{column}.{row}.otbm"
+SECTION_TYPES = [HEADERS["OTBM_TOWNS"], HEADERS["OTBM_WAYPOINTS"]]
+
+def region_size(length, count):
+    # Region sides are a whole number of 256-tile areas
+    areas = -(-length // 256)
+    return max(1, -(-areas // count)) * 256
+
+def other_features(lazy_map):
+    return [
+        entry
+        for entry in lazy_map.features
+        if entry.type != HEADERS["OTBM_TILE_AREA"] and entry.type not in SECTION_TYPES
+    ]
+
+def write_section(writer, node_type, nodes):
+    if nodes:
+        writer.write(Node.create(node_type, {}, nodes))
+
+def split_otbm(infile, outdir, columns, rows):
+    # Writes columns x rows region maps named after REGION_NAME and returns
+    # their paths, row by row. Each tile area goes whole to the region holding
+    # its origin and is copied without decoding; towns and waypoints go to the
+    # region holding their position. Every region keeps the source header, so
+    # mapWidth/mapHeight stay those of the whole world.
+    os.makedirs(outdir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(infile))[0]
+    paths = []
+
+    with LazyMap(infile) as source:
+        width = region_size(source.header.mapWidth, columns)
+        height = region_size(source.header.mapHeight, rows)
+
+        def region(x, y):
+            return min(x // width, columns - 1), min(y // height, rows - 1)
+
+        areas = {}
+        for entry in source.areas:
+            areas.setdefault(region(entry.x, entry.y), []).append(entry)
+
+        sections = {}
+        for node_type, nodes in read_sections(source).items():
+            for node in nodes.values():
+                sections.setdefault((region(node.x, node.y), node_type), []).append(node)
+
+        for row in range(rows):
+            for column in range(columns):
+                path = os.path.join(outdir, REGION_NAME.format(name=name, column=column, row=row))
+                with OTBMWriter(path, source.header, source.map_data, source.identifier) as writer:
+                    for entry in areas.get((column, row), []):
+                        writer.copy(source.data[entry.start:entry.end])
+                    # Features the regions cannot place stay with the first one
+                    if not paths:
+                        for entry in other_features(source):
+                            writer.copy(source.data[entry.start:entry.end])
+                    for node_type in SECTION_TYPES:
+                        write_section(writer, node_type, sections.get(((column, row), node_type)))
+                paths.append(path)
+
+    return paths
+
+def merge_otbm(infiles, outfile):
+    # Streams the regions into one map, one 256x256 chunk at a time in sorted
+    # chunk order: tiles are regrouped into aligned areas, a tile found in
+    # several inputs is taken from the last one. An aligned area that alone
+    # covers its chunk is copied without decoding. Towns and waypoints are
+    # merged by id/name, the first input holding one wins. The header and map
+    # data attributes come from the first input. The merged map replaces
+    # outfile only once complete, so outfile may be one of the inputs.
+    sources = []
+    try:
+        for infile in infiles:
+            sources.append(LazyMap(infile))
+
+        first = sources[0]
+        header = Node.create(HEADERS["OTBM_MAP_HEADER"], {
+            **node_attributes(first.header),
+            "mapWidth": max(source.header.mapWidth for source in sources),
+            "mapHeight": max(source.header.mapHeight for source in sources),
+        })
+        indexes = [index_chunks(source) for source in sources]
+
+        with replacing_file(outfile) as temporary, OTBMWriter(temporary, header, first.map_data, first.identifier) as writer:
+            for key in sorted(set().union(*indexes)):
+                cx, cy, z = key
+                covering = [(source, index[key]) for source, index in zip(sources, indexes) if key in index]
+                if len(covering) == 1 and len(covering[0][1]) == 1:
+                    source, (entry,) = covering[0]
+                    if (entry.x, entry.y) == (cx << 8, cy << 8):
+                        writer.copy(source.data[entry.start:entry.end])
+                        continue
+
+                tiles = {}
+                for source, entries in covering:
+                    tiles.update(read_chunk(source, entries, key))
+                if not tiles:
+                    continue
+                writer.begin_area(cx << 8, cy << 8, z)
+                for tile in tiles.values():
+                    writer.copy(tile)
+                writer.end_area()
+
+            for source in sources:
+                for entry in other_features(source):
+                    writer.copy(source.data[entry.start:entry.end])
+
+            sections = {node_type: {} for node_type in SECTION_TYPES}
+            for source in sources:
+                for node_type, nodes in read_sections(source).items():
+                    for key, node in nodes.items():
+                        sections[node_type].setdefault(key, node)
+            for node_type in SECTION_TYPES:
+                write_section(writer, node_type, list(sections[node_type].values()))
+    finally:
+        for source in sources:
+            source.close()
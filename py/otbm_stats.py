@@ -0,0 +1,220 @@
+import contextvars
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import otbm2json
+from otbm2json import Node
+
+READ_PHASES = {
+    "read_node": "scan",
+    "iter_nodes": "scan",
+    "unescape_characters": "unescape",
+    "read_attributes": "attribute_decode",
+}
+
+WRITE_PHASES = {
+    "write_node": "write",
+    "iter_node_chunks": "write",
+    "write_element": "encode",
+    "write_attributes": "attribute_encode",
+    "escape_characters": "escape",
+}
+
+# Stats of the instrument() blocks active in the current thread or asyncio
+# task; the wrappers report to these only.
+ACTIVE_STATS = contextvars.ContextVar("otbm_stats", default=())
+
+class OTBMStats:
+    # Per-phase times are exclusive: time spent in a nested instrumented call
+    # (e.g. unescaping inside object build) is only counted for the inner phase.
+    def __init__(self):
+        self.nodes_read = Counter()
+        self.nodes_written = Counter()
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.escapes_read = 0
+        self.escapes_written = 0
+        self.times = Counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def as_dict(self):
+        return {
+            "nodes_read": {otbm2json.NODE_EVENTS.get(key, key): value for key, value in self.nodes_read.items()},
+            "nodes_written": {otbm2json.NODE_EVENTS.get(key, key): value for key, value in self.nodes_written.items()},
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "escapes_read": self.escapes_read,
+            "escapes_written": self.escapes_written,
+            "times": dict(self.times),
+        }
+
+    def enter(self):
+        # Nesting frames are per thread, so calls made from executor threads
+        # on behalf of one block do not interleave
+        frames = self.local.__dict__.setdefault("frames", [])
+        frames.append(0.0)
+        return time.perf_counter()
+
+    def leave(self, phase, start):
+        elapsed = time.perf_counter() - start
+        frames = self.local.frames
+        exclusive = elapsed - frames.pop()
+        if frames:
+            frames[-1] += elapsed
+        with self.lock:
+            self.times[phase] += exclusive
+
+def timed(phase, function):
+    def wrapper(*args, **kwargs):
+        active = ACTIVE_STATS.get()
+        if not active:
+            return function(*args, **kwargs)
+        starts = [stats.enter() for stats in active]
+        try:
+            return function(*args, **kwargs)
+        finally:
+            for stats, start in zip(active, starts):
+                stats.leave(phase, start)
+
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def timed_iter(phase, function):
+    # Generators are timed per next(), so consumer time stays out of the phase
+    def wrapper(*args, **kwargs):
+        iterator = function(*args, **kwargs)
+        while True:
+            active = ACTIVE_STATS.get()
+            starts = [stats.enter() for stats in active]
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                for stats, start in zip(active, starts):
+                    stats.leave(phase, start)
+            yield item
+
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def counting_unescape(function):
+    def wrapper(data):
+        result = function(data)
+        for stats in ACTIVE_STATS.get():
+            with stats.lock:
+                stats.bytes_read += len(data)
+                stats.escapes_read += len(data) - len(result)
+        return result
+
+    return wrapper
+
+def counting_escape(function):
+    def wrapper(buffer):
+        result = function(buffer)
+        for stats in ACTIVE_STATS.get():
+            with stats.lock:
+                stats.bytes_written += len(result) + 2
+                stats.escapes_written += len(result) - len(buffer)
+        return result
+
+    return wrapper
+
+def counting_element(function):
+    def wrapper(node):
+        for stats in ACTIVE_STATS.get():
+            with stats.lock:
+                stats.nodes_written[node.type] += 1
+        return function(node)
+
+    return wrapper
+
+def build_node(function):
+    def wrapper(self, data, children):
+        active = ACTIVE_STATS.get()
+        if not active:
+            return function(self, data, children)
+        starts = [stats.enter() for stats in active]
+        try:
+            function(self, data, children)
+        finally:
+            for stats, start in zip(active, starts):
+                stats.leave("object_build", start)
+        for stats in active:
+            with stats.lock:
+                stats.nodes_read[self.type] += 1
+
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def instrumented(originals):
+    functions = {}
+    for name, phase in {**READ_PHASES, **WRITE_PHASES}.items():
+        function = originals[name]
+        wrap = timed_iter if name in {"iter_nodes", "iter_node_chunks"} else timed
+        if name == "unescape_characters":
+            function = counting_unescape(function)
+        elif name == "escape_characters":
+            function = counting_escape(function)
+        elif name == "write_element":
+            function = counting_element(function)
+        functions[name] = wrap(phase, function)
+    return functions
+
+INSTALL_LOCK = threading.Lock()
+installation = {"count": 0}
+
+def install():
+    # The wrappers are installed by the first active block and removed by the
+    # last one, in whatever order the blocks exit
+    with INSTALL_LOCK:
+        installation["count"] += 1
+        if installation["count"] > 1:
+            return
+
+        originals = {name: getattr(otbm2json, name) for name in {**READ_PHASES, **WRITE_PHASES}}
+        wrappers = instrumented(originals)
+        for name, wrapper in wrappers.items():
+            for module in list(sys.modules.values()):
+                if getattr(module, name, None) is originals[name]:
+                    setattr(module, name, wrapper)
+        installation.update(originals=originals, wrappers=wrappers, node_init=Node.__init__)
+        Node.__init__ = build_node(Node.__init__)
+
+def uninstall():
+    with INSTALL_LOCK:
+        installation["count"] -= 1
+        if installation["count"] > 0:
+            return
+
+        originals = installation.pop("originals")
+        wrappers = installation.pop("wrappers")
+        Node.__init__ = installation.pop("node_init")
+        for name, wrapper in wrappers.items():
+            for module in list(sys.modules.values()):
+                if getattr(module, name, None) is wrapper:
+                    setattr(module, name, originals[name])
+
+@contextmanager
+def instrument(callback=None):
+    # Swaps the reader/writer functions for counting, timed wrappers in
+    # otbm2json and in every module that imported them by name, while any
+    # block is active; nothing is checked in the hot loops outside of them.
+    # A block only counts work done in its own context: the thread or asyncio
+    # task it runs in, and threads started with a copy of that context (as
+    # otbm_async does for its executor steps).
+    stats = OTBMStats()
+    install()
+    ACTIVE_STATS.set(ACTIVE_STATS.get() + (stats,))
+
+    try:
+        yield stats
+    finally:
+        ACTIVE_STATS.set(tuple(active for active in ACTIVE_STATS.get() if active is not stats))
+        uninstall()
+        if callback is not None:
+            callback(stats)
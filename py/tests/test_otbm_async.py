@@ -0,0 +1,32 @@
+import asyncio
+import os
+import stat
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import read_otbm, write_otbm
+from otbm_async import awrite_otbm
+
+LAVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lava.otbm")
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def test_new_map_gets_write_otbm_permissions(tmp_path):
+    data = read_otbm(LAVA)
+    expected = tmp_path / "expected.otbm"
+    saved = tmp_path / "saved.otbm"
+    write_otbm(expected, data)
+    asyncio.run(awrite_otbm(str(saved), data))
+    assert mode(saved) == mode(expected)
+    assert saved.read_bytes() == expected.read_bytes()
+
+def test_existing_map_keeps_its_permissions(tmp_path):
+    data = read_otbm(LAVA)
+    saved = tmp_path / "saved.otbm"
+    saved.write_bytes(b"")
+    os.chmod(saved, 0o640)
+    asyncio.run(awrite_otbm(str(saved), data))
+    assert mode(saved) == 0o640
+    assert os.listdir(tmp_path) == ["saved.otbm"]
@@ -0,0 +1,61 @@
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import HEADERS, Node, OTBMWriter, read_otbm, serialize_otbm
+from otbm_incremental import dirty_areas, read_otbm_incremental, serialize_otbm_incremental, write_otbm_incremental
+
+HEADER = {"version": 2, "mapWidth": 512, "mapHeight": 256, "itemsMajorVersion": 3, "itemsMinorVersion": 57}
+ZONES = {"protection": True, "noPVP": False, "noLogout": False, "PVPZone": False, "refresh": False}
+
+@pytest.fixture
+def infile(tmp_path):
+    path = tmp_path / "map.otbm"
+    with OTBMWriter(path, HEADER, {"description": "incremental"}) as writer:
+        for x in (0, 256):
+            writer.begin_area(x, 0, 7)
+            teleport = Node.create(HEADERS["OTBM_ITEM"], {"id": 1387, "destination": {"x": 5, "y": 6, "z": 7}})
+            writer.add_tile(Node.create(HEADERS["OTBM_TILE"], {"x": 1, "y": 2, "tileid": 100, "zones": dict(ZONES)}, [teleport]))
+            writer.end_area()
+    return str(path)
+
+def first_tile(data):
+    return data["data"].nodes[0].features[0].tiles[0]
+
+def test_clean_map_is_copied(infile):
+    data = read_otbm_incremental(infile)
+    assert dirty_areas(data) == []
+    with open(infile, "rb") as f:
+        assert serialize_otbm_incremental(data) == f.read()
+
+@pytest.mark.parametrize("edit", [
+    lambda tile: tile.zones.__setitem__("noLogout", True),
+    lambda tile: tile.zones.update(noPVP=True),
+    lambda tile: tile.items[0].destination.__setitem__("x", 99),
+    lambda tile: tile.items[0].destination.pop("z") and tile.items[0].destination.setdefault("z", 8),
+])
+def test_in_place_dict_edits_mark_area_dirty(infile, edit):
+    data = read_otbm_incremental(infile)
+    edit(first_tile(data))
+    assert dirty_areas(data) == [data["data"].nodes[0].features[0]]
+
+    write_otbm_incremental(infile, data)
+    assert serialize_otbm(read_otbm(infile)) == serialize_otbm(data)
+
+def test_failed_write_leaves_no_temporary_file(infile):
+    data = read_otbm_incremental(infile)
+    first_tile(data).x = 1000
+    with pytest.raises(ValueError):
+        write_otbm_incremental(infile, data)
+    assert os.listdir(os.path.dirname(infile)) == ["map.otbm"]
+
+def test_write_keeps_map_permissions(infile):
+    os.chmod(infile, 0o640)
+    data = read_otbm_incremental(infile)
+    first_tile(data).tileid = 101
+    write_otbm_incremental(infile, data)
+    assert stat.S_IMODE(os.stat(infile).st_mode) == 0o640
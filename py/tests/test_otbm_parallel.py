@@ -0,0 +1,36 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from otbm2json import get_child_node, read_otbm, serialize_otbm
+from otbm_parallel import serialize_otbm_parallel
+
+LAVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lava.otbm")
+
+def maps():
+    lava = read_otbm(LAVA)
+    smaller = read_otbm(LAVA)
+    get_child_node(get_child_node(smaller["data"])[0]).pop(0)
+    return lava, smaller
+
+def test_process_workers_match_serial_output():
+    for data in maps():
+        assert serialize_otbm_parallel(data, 2, "process") == serialize_otbm(data)
+
+def test_concurrent_calls_serialize_their_own_map():
+    trees = maps()
+    expected = [serialize_otbm(data) for data in trees]
+    for _ in range(3):
+        results = [None] * len(trees)
+
+        def run(position):
+            results[position] = serialize_otbm_parallel(trees[position], 2, "process")
+
+        threads = [threading.Thread(target=run, args=(position,)) for position in range(len(trees))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results == expected
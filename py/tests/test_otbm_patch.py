@@ -0,0 +1,49 @@
+import os
+import shutil
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import otbm_patch
+from otbm2json import read_otbm, serialize_otbm, write_otbm
+from otbm_patch import apply_patch, diff_otbm
+
+LAVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lava.otbm")
+
+@pytest.fixture
+def maps(tmp_path):
+    old = tmp_path / "old.otbm"
+    new = tmp_path / "new.otbm"
+    shutil.copy(LAVA, old)
+    data = read_otbm(LAVA)
+    data["data"].nodes[0].features[0].tiles[0].tileid = 599
+    write_otbm(new, data)
+    patch = tmp_path / "map.otbp"
+    diff_otbm(str(old), str(new), str(patch))
+    os.chmod(old, 0o640)
+    return str(old), str(new), str(patch)
+
+def test_patch_applied_in_place(maps):
+    old, new, patch = maps
+    apply_patch(old, patch, old)
+    assert serialize_otbm(read_otbm(old)) == serialize_otbm(read_otbm(new))
+    assert stat.S_IMODE(os.stat(old).st_mode) == 0o640
+    assert sorted(os.listdir(os.path.dirname(old))) == ["map.otbp", "new.otbm", "old.otbm"]
+
+def test_failed_patch_leaves_map_untouched(maps, monkeypatch):
+    old, new, patch = maps
+    with open(old, "rb") as f:
+        original = f.read()
+
+    def fail(*args):
+        raise RuntimeError("patch failed")
+
+    monkeypatch.setattr(otbm_patch, "patch_section", fail)
+    with pytest.raises(RuntimeError):
+        apply_patch(old, patch, old)
+    with open(old, "rb") as f:
+        assert f.read() == original
+    assert sorted(os.listdir(os.path.dirname(old))) == ["map.otbp", "new.otbm", "old.otbm"]
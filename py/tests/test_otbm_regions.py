@@ -0,0 +1,44 @@
+import os
+import stat
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import otbm_regions
+from otbm2json import read_otbm, serialize_otbm
+from otbm_regions import merge_otbm, split_otbm
+
+LAVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lava.otbm")
+
+@pytest.fixture
+def regions(tmp_path):
+    paths = split_otbm(LAVA, str(tmp_path), 2, 2)
+    os.chmod(paths[0], 0o640)
+    return paths
+
+def test_merge_into_first_region(regions, tmp_path):
+    merged = str(tmp_path / "merged.otbm")
+    merge_otbm(regions, merged)
+    expected = serialize_otbm(read_otbm(merged))
+    os.remove(merged)
+
+    merge_otbm(regions, regions[0])
+    assert serialize_otbm(read_otbm(regions[0])) == expected
+    assert stat.S_IMODE(os.stat(regions[0]).st_mode) == 0o640
+
+def test_failed_merge_leaves_region_untouched(regions, monkeypatch):
+    with open(regions[0], "rb") as f:
+        original = f.read()
+    files = sorted(os.listdir(os.path.dirname(regions[0])))
+
+    def fail(*args):
+        raise RuntimeError("merge failed")
+
+    monkeypatch.setattr(otbm_regions, "write_section", fail)
+    with pytest.raises(RuntimeError):
+        merge_otbm(regions, regions[0])
+    with open(regions[0], "rb") as f:
+        assert f.read() == original
+    assert sorted(os.listdir(os.path.dirname(regions[0]))) == files
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import otbm2json
+import otbm_lazy
+from otbm_async import aread_otbm
+from otbm_stats import instrument
+
+LAVA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lava.otbm")
+VOID = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "void.otbm")
+
+def nodes_read(stats):
+    return sum(stats.nodes_read.values())
+
+def test_overlapping_blocks_exiting_out_of_order():
+    read_node = otbm2json.read_node
+    node_init = otbm2json.Node.__init__
+
+    first = instrument()
+    second = instrument()
+    a = first.__enter__()
+    b = second.__enter__()
+    otbm2json.read_otbm(LAVA)
+    first.__exit__(None, None, None)
+    otbm2json.read_otbm(LAVA)
+    second.__exit__(None, None, None)
+
+    assert otbm2json.read_node is read_node
+    assert otbm_lazy.read_node is read_node
+    assert otbm2json.Node.__init__ is node_init
+    assert nodes_read(b) == 2 * nodes_read(a) > 0
+
+    counted = nodes_read(a)
+    otbm2json.read_otbm(LAVA)
+    assert nodes_read(a) == counted
+
+def test_other_threads_are_not_counted():
+    with instrument() as stats:
+        thread = threading.Thread(target=otbm2json.read_otbm, args=(LAVA,))
+        thread.start()
+        thread.join()
+    assert nodes_read(stats) == 0
+
+def test_concurrent_tasks_count_their_own_work():
+    async def load(path):
+        with instrument() as stats:
+            await aread_otbm(path)
+        return nodes_read(stats)
+
+    async def main():
+        return await asyncio.gather(load(LAVA), load(VOID))
+
+    with instrument() as lava:
+        otbm2json.read_otbm(LAVA)
+    with instrument() as void:
+        otbm2json.read_otbm(VOID)
+    assert asyncio.run(main()) == [nodes_read(lava), nodes_read(void)]